@@ -0,0 +1,56 @@
+"""compare BlacklistMatcher with naive substring scan of all blacklist words
+
+usage: python -m benchmarks.blacklist [words] [posts] [post_length]
+"""
+import random
+import string
+import sys
+import time
+
+from utils.blacklist import BlacklistMatcher
+
+
+def random_word(rnd: random.Random) -> str:
+    return ''.join(rnd.choice(string.ascii_lowercase + 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя')
+                   for _ in range(rnd.randint(4, 12)))
+
+
+def naive_search(words, text: str) -> bool:
+    """old is_allowed_post check"""
+    return bool([True for word in words if word in text])
+
+
+def run(words_count: int = 10000, posts_count: int = 200, post_length: int = 4000):
+    rnd = random.Random(42)
+    words = [random_word(rnd) for _ in range(words_count)]
+    posts = []
+    for number in range(posts_count):
+        post_words = []
+        while sum(len(word) + 1 for word in post_words) < post_length:
+            post_words.append(random_word(rnd))
+        if number % 10 == 0:
+            post_words.insert(rnd.randrange(len(post_words)), rnd.choice(words).upper())
+        posts.append(' '.join(post_words))
+
+    started_at = time.perf_counter()
+    matcher = BlacklistMatcher(words)
+    build_time = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    matched = [bool(matcher.search(post)) for post in posts]
+    matcher_time = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    naive_matched = [naive_search(words, post.lower()) for post in posts]
+    naive_time = time.perf_counter() - started_at
+
+    print(f'words: {words_count}, posts: {posts_count}, post length: ~{post_length}')
+    print(f'automaton build: {build_time * 1000:.1f}ms')
+    print(f'aho-corasick: {matcher_time / posts_count * 1000:.3f}ms per post, matched: {sum(matched)}')
+    print(f'naive scan:   {naive_time / posts_count * 1000:.3f}ms per post, matched: {sum(naive_matched)}')
+    assert matched == naive_matched, 'matcher results differ from naive scan'
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
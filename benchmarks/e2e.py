@@ -0,0 +1,339 @@
+"""run real Controller pipeline against local VK and Telegram api stand-ins and report throughput
+
+every channel size is measured in separate child process, so RSS belongs to the pipeline only.
+fake servers live in parent process, enforce VK and Telegram rate limits and inject latency and errors.
+
+usage: python -m benchmarks.e2e [--sizes 10,100,1000,10000] [--posts 5] [--fanout 1] [--vk-latency 0.05] ...
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+from collections import deque
+from typing import Dict
+from typing import List
+
+from aiohttp import web
+
+EXECUTE_CALL_PATTERN = re.compile(r'API\.([\w.]+)\((\{.*?\})\)')
+CHILD_RESULT_PREFIX = 'RESULT '
+
+
+class SlidingWindowLimit:
+    """allow at most rate events in any window of seconds"""
+    def __init__(self, rate: float, window: float = 1.0):
+        self.rate = rate
+        self.window = window
+        self._events = deque()
+
+    def get_retry_after(self, now: float) -> float:
+        """register event and get zero or seconds until event would be allowed"""
+        while self._events and self._events[0] <= now - self.window:
+            self._events.popleft()
+        if len(self._events) >= self.rate:
+            return self._events[0] + self.window - now
+        self._events.append(now)
+        return 0
+
+
+class FakeVk:
+    """wall.get, video.get and execute with per token rate limit, latency and error injection"""
+    def __init__(self, rate: float = 3, latency: float = 0.05, error_rate: float = 0, posts_per_source: int = 5):
+        self.rate = rate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.posts_per_source = posts_per_source
+        self._random = random.Random(42)
+        self._limits: Dict[str, SlidingWindowLimit] = {}
+        self._walls: Dict[str, List[Dict]] = {}
+        self.requests = 0
+        self.calls = 0
+        self.flood_errors = 0
+
+    def reset(self):
+        self._limits.clear()
+        self._walls.clear()
+        self.requests = self.calls = self.flood_errors = 0
+
+    def _get_wall(self, domain: str) -> List[Dict]:
+        """get generated newest first posts of source"""
+        if domain not in self._walls:
+            owner_id = -int(re.sub(r'\D', '', domain) or 0) - 1
+            now = int(time.time())
+            posts = []
+            for post_id in range(1, self.posts_per_source + 1):
+                post = {'id': post_id, 'owner_id': owner_id, 'from_id': owner_id, 'date': now - 60 * (10 - post_id),
+                        'text': f'Post {post_id} from {domain}: ' + ' '.join(
+                            self._random.choice(('news', 'photo', 'новости', 'день', 'город', 'video', 'погода'))
+                            for _ in range(30)),
+                        'attachments': []}
+                if post_id % 3 == 0:
+                    post['attachments'].append({'type': 'photo', 'photo': {
+                        'sizes': [{'url': f'https://sun.userapi.com/{domain}/{post_id}.jpg'}]}})
+                elif post_id % 3 == 1:
+                    post['attachments'].append({'type': 'video', 'video': {
+                        'owner_id': owner_id, 'id': post_id, 'title': 'video', 'access_key': 'key'}})
+                posts.append(post)
+            self._walls[domain] = posts[::-1]
+        return self._walls[domain]
+
+    def _call(self, method: str, params: Dict):
+        """get method result or error dict"""
+        self.calls += 1
+        if self.error_rate and self._random.random() < self.error_rate:
+            return {'error_code': 10, 'error_msg': 'Internal server error'}
+        if method == 'wall.get':
+            posts = self._get_wall(params['domain'])
+            return {'count': len(posts), 'items': posts[:int(params.get('count', 20))]}
+        if method == 'video.get':
+            items = []
+            for video_id in str(params.get('videos', '')).split(','):
+                owner_id, item_id = video_id.split('_')[:2]
+                items.append({'owner_id': int(owner_id), 'id': int(item_id), 'title': 'video',
+                              'files': {'mp4_480': f'https://vk.com/video{owner_id}_{item_id}.mp4'}})
+            return {'count': len(items), 'items': items}
+        return {'error_code': 3, 'error_msg': 'Unknown method passed'}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        data = await request.post()
+        method = request.match_info['method']
+        await asyncio.sleep(self.latency)
+        limit = self._limits.setdefault(data.get('access_token', ''), SlidingWindowLimit(self.rate))
+        if limit.get_retry_after(time.monotonic()):
+            self.flood_errors += 1
+            return web.json_response({'error': {'error_code': 6, 'error_msg': 'Too many requests per second'}})
+        if method == 'execute':
+            response, errors = [], []
+            for call_method, params in EXECUTE_CALL_PATTERN.findall(data['code']):
+                result = self._call(call_method, json.loads(params))
+                if 'error_code' in result:
+                    errors.append({'method': call_method, **result})
+                    result = False
+                response.append(result)
+            return web.json_response({'response': response, **({'execute_errors': errors} if errors else {})})
+        result = self._call(method, dict(data))
+        if 'error_code' in result:
+            return web.json_response({'error': result})
+        return web.json_response({'response': result})
+
+
+class FakeTelegram:
+    """sendMessage and sendMediaGroup with global and per chat flood control"""
+    def __init__(self, rate: float = 30, chat_interval: float = 1, latency: float = 0.05, error_rate: float = 0,
+                 admin_id: int = 0):
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.latency = latency
+        self.error_rate = error_rate
+        self.admin_id = admin_id
+        self._random = random.Random(43)
+        self._limit = SlidingWindowLimit(rate)
+        self._chats_sent_at: Dict[str, float] = {}
+        self._message_id = 0
+        self.deliveries: List[float] = []
+        self.requests = 0
+        self.flood_errors = 0
+        self.admin_messages = 0
+
+    def reset(self):
+        self._limit = SlidingWindowLimit(self.rate)
+        self._chats_sent_at.clear()
+        self.deliveries = []
+        self.requests = self.flood_errors = self.admin_messages = 0
+
+    def _message(self, chat_id: str) -> Dict:
+        self._message_id += 1
+        return {'message_id': self._message_id, 'date': int(time.time()),
+                'chat': {'id': -1000 if not chat_id.lstrip('-').isdigit() else int(chat_id), 'type': 'channel'}}
+
+    @staticmethod
+    def _flood_response(retry_after: float) -> web.Response:
+        retry_after = max(int(math.ceil(retry_after)), 1)
+        return web.json_response({'ok': False, 'error_code': 429, 'parameters': {'retry_after': retry_after},
+                                  'description': f'Too Many Requests: retry after {retry_after}'}, status=429)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        data = await request.post()
+        method = request.match_info['method']
+        chat_id = str(data.get('chat_id', ''))
+        await asyncio.sleep(self.latency)
+        if chat_id == str(self.admin_id):
+            self.admin_messages += 1
+            return web.json_response({'ok': True, 'result': self._message(chat_id)})
+        now = time.monotonic()
+        chat_retry_after = self._chats_sent_at.get(chat_id, -math.inf) + self.chat_interval - now
+        if chat_retry_after > 0 and not data.get('reply_to_message_id'):
+            self.flood_errors += 1
+            return self._flood_response(chat_retry_after)
+        retry_after = self._limit.get_retry_after(now)
+        if retry_after:
+            self.flood_errors += 1
+            return self._flood_response(retry_after)
+        if self.error_rate and self._random.random() < self.error_rate:
+            return web.json_response({'ok': False, 'error_code': 400, 'description': 'Bad Request: injected'},
+                                     status=400)
+        self._chats_sent_at[chat_id] = now
+        if method == 'sendMediaGroup':
+            self.deliveries.append(time.time())
+            return web.json_response({'ok': True, 'result': [self._message(chat_id)
+                                                             for _ in json.loads(data.get('media', '[]'))]})
+        if not data.get('reply_to_message_id'):
+            self.deliveries.append(time.time())
+        return web.json_response({'ok': True, 'result': self._message(chat_id)})
+
+
+def get_percentile(values: List[float], percent: float) -> float:
+    """get nearest rank percentile"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(int(math.ceil(percent / 100 * len(values))) - 1, 0))]
+
+
+async def run_child(channels_count: int, fanout: int, timeout: float):
+    """fill temp db, run controller pipeline until every channel is checked and queue is drained"""
+    import aiogram.bot.api
+    from aiogram import Bot
+
+    from utils.controller import Controller
+    from utils.db import DbController
+    from utils.metrics import metrics
+
+    # aiogram 2.9 has no custom api server option, route real bot requests to fake telegram
+    aiogram.bot.api.API_URL = os.environ['BENCHMARK_TELEGRAM_URL'] + '/bot{token}/{method}'
+    logger = logging.getLogger('benchmark')
+    logging.basicConfig(level=logging.WARNING)
+
+    channels = [(True, f'bench{number}', f'club{number // fanout}', 0, True, False, True, True, True, False, 60, True)
+                for number in range(channels_count)]
+    db = DbController(os.environ['DB_PATH'])
+    db.get_cursor().executemany('INSERT INTO channels (is_active, telegram_channel, vk_channel, last_post_id, '
+                                'send_video_post, send_video_post_text, send_photo_post, send_photo_post_text, '
+                                'send_text_post, set_last_post_id, timer, enable_filters) '
+                                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', channels)
+    db.get_cursor().connection.commit()
+    db.close()
+
+    bot = Bot(token=os.environ['TELEGRAM_TOKEN'])
+    controller = Controller(os.environ['VK_TOKEN'], bot, logger)
+    await controller.load()
+    checks = metrics.get('check_channel_duration_seconds')
+    started_at = time.time()
+    await controller.start_parser()
+    sender = controller.parser.sender
+    while time.time() - started_at < timeout:
+        await asyncio.sleep(0.1)
+        if checks.count() >= channels_count and not sender.pending:
+            break
+    finished_at = time.time()
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = {'channels': channels_count, 'started_at': started_at, 'finished_at': finished_at,
+              'checked': checks.count(), 'sent': sender.sent, 'failed': sender.failed, 'retried': sender.retried,
+              'pending': sender.pending, 'rss_kb': rss_kb, 'timed_out': finished_at - started_at >= timeout}
+    await controller.shutdown()
+    await bot.close()
+    print(CHILD_RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+async def run_size(args, channels_count: int, fake_vk: FakeVk, fake_telegram: FakeTelegram, vk_url: str,
+                   telegram_url: str) -> Dict:
+    """run child process for channels count and collect fake servers stats"""
+    fake_vk.reset()
+    fake_telegram.reset()
+    with tempfile.TemporaryDirectory() as directory:
+        env = {**os.environ, 'DB_PATH': os.path.join(directory, 'channels.db'), 'VK_API_URL': vk_url,
+               'BENCHMARK_TELEGRAM_URL': telegram_url, 'TELEGRAM_TOKEN': '123456:benchmark', 'VK_TOKEN': 'benchmark',
+               'ADMIN_ID': str(fake_telegram.admin_id), 'TELEGRAM_GLOBAL_RATE': str(args.telegram_rate),
+               'TELEGRAM_CHAT_INTERVAL': str(args.telegram_chat_interval), 'VK_REQUESTS_PER_SECOND': str(args.vk_rate),
+               'STARTUP_SPREAD_MAX': '0'}
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, '-m', 'benchmarks.e2e', '--child', str(channels_count), '--fanout', str(args.fanout),
+            '--timeout', str(args.timeout), env=env, stdout=asyncio.subprocess.PIPE)
+        stdout, _ = await process.communicate()
+    lines = [line for line in stdout.decode().splitlines() if line.startswith(CHILD_RESULT_PREFIX)]
+    if not lines:
+        raise RuntimeError(f'benchmark child for {channels_count} channels failed')
+    result = json.loads(lines[-1][len(CHILD_RESULT_PREFIX):])
+    latencies = [delivered_at - result['started_at'] for delivered_at in fake_telegram.deliveries]
+    elapsed = (max(fake_telegram.deliveries) if latencies else result['finished_at']) - result['started_at']
+    delivered = len(latencies)
+    result.update({'delivered': delivered, 'posts_per_second': delivered / elapsed if elapsed > 0 else 0,
+                   'vk_requests': fake_vk.requests, 'vk_calls': fake_vk.calls, 'vk_flood': fake_vk.flood_errors,
+                   'telegram_requests': fake_telegram.requests, 'telegram_flood': fake_telegram.flood_errors,
+                   'admin_messages': fake_telegram.admin_messages,
+                   'requests_per_post': (fake_vk.requests / delivered) if delivered else 0,
+                   'p50': get_percentile(latencies, 50), 'p99': get_percentile(latencies, 99)})
+    return result
+
+
+async def run(args):
+    fake_vk = FakeVk(args.vk_rate, args.vk_latency, args.vk_error_rate, args.posts)
+    fake_telegram = FakeTelegram(args.telegram_rate, args.telegram_chat_interval, args.telegram_latency,
+                                 args.telegram_error_rate)
+    vk_app = web.Application()
+    vk_app.router.add_post('/method/{method}', fake_vk.handle)
+    telegram_app = web.Application(client_max_size=1024 ** 3)
+    telegram_app.router.add_post('/bot{token}/{method}', fake_telegram.handle)
+    runners = []
+    urls = []
+    for app in (vk_app, telegram_app):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        runners.append(runner)
+        urls.append(f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}')
+    vk_url, telegram_url = f'{urls[0]}/method', urls[1]
+
+    print(f'posts per source: {args.posts}, channels per source: {args.fanout}, '
+          f'vk: {args.vk_rate} rps {args.vk_latency * 1000:.0f}ms {args.vk_error_rate:.0%} errors, '
+          f'telegram: {args.telegram_rate} rps {args.telegram_latency * 1000:.0f}ms '
+          f'{args.telegram_error_rate:.0%} errors')
+    print(f"{'channels':>8} {'posts/s':>8} {'sent':>6} {'vk req':>7} {'req/post':>8} {'vk 429':>6} {'tg 429':>6} "
+          f"{'p50 s':>7} {'p99 s':>7} {'rss MB':>7}")
+    try:
+        for channels_count in args.sizes:
+            result = await run_size(args, channels_count, fake_vk, fake_telegram, vk_url, telegram_url)
+            print(f"{result['channels']:>8} {result['posts_per_second']:>8.1f} {result['delivered']:>6} "
+                  f"{result['vk_requests']:>7} {result['requests_per_post']:>8.2f} {result['vk_flood']:>6} "
+                  f"{result['telegram_flood']:>6} {result['p50']:>7.2f} {result['p99']:>7.2f} "
+                  f"{result['rss_kb'] / 1024:>7.1f}{' timeout' if result['timed_out'] else ''}")
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='end to end VkParser benchmark against fake api servers')
+    parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')],
+                        default=[10, 100, 1000, 10000])
+    parser.add_argument('--posts', type=int, default=5, help='new posts on every vk source')
+    parser.add_argument('--fanout', type=int, default=1, help='telegram channels subscribed to one vk source')
+    parser.add_argument('--timeout', type=float, default=900, help='max seconds for one size')
+    parser.add_argument('--vk-rate', type=float, default=3)
+    parser.add_argument('--vk-latency', type=float, default=0.05)
+    parser.add_argument('--vk-error-rate', type=float, default=0)
+    parser.add_argument('--telegram-rate', type=float, default=30)
+    parser.add_argument('--telegram-chat-interval', type=float, default=1)
+    parser.add_argument('--telegram-latency', type=float, default=0.05)
+    parser.add_argument('--telegram-error-rate', type=float, default=0)
+    parser.add_argument('--child', type=int, default=0, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.child:
+        asyncio.run(run_child(arguments.child, arguments.fanout, arguments.timeout))
+    else:
+        asyncio.run(run(arguments))
@@ -0,0 +1,108 @@
+"""compare memory and load time of channel dicts and parsed post namedtuples with slotted models
+
+usage: python -m benchmarks.models [channels] [posts]
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+from typing import List
+from typing import NamedTuple
+from typing import Tuple
+
+from utils.db import DbController
+from utils.models import Attachments
+from utils.models import Link
+from utils.models import Post
+
+
+class OldLink(NamedTuple):
+    title: str
+    url: str
+
+
+class OldAttachments(NamedTuple):
+    photo: Tuple[str, ...] = ()
+    video: Tuple[str, ...] = ()
+    link: Tuple[OldLink, ...] = ()
+
+
+class OldPost(NamedTuple):
+    id: int
+    owner_id: int
+    date: int
+    text: str
+    attachments: OldAttachments
+    fingerprints: List[str]
+
+
+def old_get_all_channels(db: DbController) -> List[dict]:
+    """previous select * with per column dict loop"""
+    cursor = db.get_cursor()
+    cursor.execute("SELECT * from 'channels'")
+    rows = cursor.fetchall()
+    columns = tuple(map(lambda row: row[0], cursor.description))
+    channels = []
+    for row in rows:
+        row_dict = {}
+        for index, column in enumerate(columns):
+            row_dict[column] = row[index]
+        channels.append(row_dict)
+    return channels
+
+
+def measure(build: Callable) -> Tuple[object, float, float]:
+    """get built objects, retained MB and seconds"""
+    gc.collect()
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started_at
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current / 1024 / 1024, elapsed
+
+
+def build_posts(count: int, post_class, attachments_class, link_class) -> list:
+    return [post_class(number, -1, 1600000000 + number, f'post text {number}',
+                       attachments_class((f'https://sun9-1.userapi.com/{number}.jpg',), (),
+                                         (link_class('link', f'https://example.com/{number}'),)),
+                       [f'text:{number:032x}'])
+            for number in range(count)]
+
+
+def run(channels_count: int = 100000, posts_count: int = 100000):
+    with tempfile.TemporaryDirectory() as directory:
+        db = DbController(os.path.join(directory, 'channels.db'))
+        with db._connection:
+            db.get_cursor().executemany(
+                "INSERT INTO channels (is_active, telegram_channel, vk_channel, vk_channel_id, last_post_id, timer) "
+                "VALUES (1, ?, ?, ?, ?, 60)",
+                [(f'@telegram_{number}', f'vk_source_{number}', -number, number * 10)
+                 for number in range(channels_count)])
+
+        old_channels, old_memory, old_time = measure(lambda: old_get_all_channels(db))
+        del old_channels
+        new_channels, new_memory, new_time = measure(db.get_all_channels)
+        del new_channels
+
+    old_posts, old_posts_memory, old_posts_time = measure(
+        lambda: build_posts(posts_count, OldPost, OldAttachments, OldLink))
+    del old_posts
+    new_posts, new_posts_memory, new_posts_time = measure(lambda: build_posts(posts_count, Post, Attachments, Link))
+    del new_posts
+
+    print(f'channels: {channels_count}, posts: {posts_count}')
+    print(f'channel dicts:   {old_memory:7.1f} MB, load {old_time:.2f}s')
+    print(f'channel models:  {new_memory:7.1f} MB, load {new_time:.2f}s')
+    print(f'post namedtuple: {old_posts_memory:7.1f} MB, build {old_posts_time:.2f}s')
+    print(f'post models:     {new_posts_memory:7.1f} MB, build {new_posts_time:.2f}s')
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
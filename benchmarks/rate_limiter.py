@@ -0,0 +1,68 @@
+"""check TokenBucket holds sustained rate under many concurrent callers using fake clock
+
+usage: python -m benchmarks.rate_limiter [callers] [rate] [burst]
+"""
+import asyncio
+import sys
+from bisect import bisect_right
+
+from utils.rate_limiter import TokenBucket
+
+
+class FakeClock:
+    """clock which moves forward only when limiter sleeps"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float):
+        await asyncio.sleep(0)
+        self.now += delay
+
+
+def get_max_window_calls(grant_times, window: float = 1.0) -> int:
+    """get max number of granted calls in any sliding window"""
+    return max(bisect_right(grant_times, started_at + window - 1e-9) - index
+               for index, started_at in enumerate(grant_times))
+
+
+async def run(callers: int = 1000, rate: float = 3, burst: int = 1):
+    clock = FakeClock()
+    limiter = TokenBucket(rate, burst, clock=clock, sleep=clock.sleep)
+    grants = []
+
+    async def caller(number: int):
+        await limiter.acquire()
+        grants.append((clock(), number))
+
+    await asyncio.gather(*[caller(number) for number in range(callers)])
+
+    grant_times = [granted_at for granted_at, _ in grants]
+    order = [number for _, number in grants]
+    elapsed = grant_times[-1]
+    sustained_rate = (callers - burst) / elapsed if elapsed else float('inf')
+    max_window_calls = get_max_window_calls(grant_times)
+
+    print(f'callers: {callers}, rate: {rate}/s, burst: {burst}')
+    print(f'simulated time: {elapsed:.2f}s, sustained rate: {sustained_rate:.3f}/s')
+    print(f'max calls in 1s window: {max_window_calls}')
+    print(f'fifo order kept: {order == sorted(order)}')
+
+    assert order == sorted(order), 'waiters were not served in FIFO order'
+    assert abs(sustained_rate - rate) < 0.01, 'sustained rate differs from configured rate'
+    assert max_window_calls <= rate + burst, 'limiter let through more calls than allowed'
+
+    clock.now += 5
+    limiter.penalize()
+    penalized_at = clock()
+    await limiter.acquire()
+    assert clock() - penalized_at >= 1, 'limiter did not back off after flood error'
+    print(f'backoff after flood error: {clock() - penalized_at:.2f}s')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    asyncio.run(run(int(args[0]) if args else 1000, float(args[1]) if len(args) > 1 else 3,
+                    int(args[2]) if len(args) > 2 else 1))
@@ -12,10 +12,58 @@ CREATE TABLE channels (
     send_text_post boolean default false,
     set_last_post_id boolean default true,
     timer integer default 60,
-    enable_filters boolean default true
+    enable_filters boolean default true,
+    adaptive_timer boolean default false,
+    post_interval real default 0,
+    last_post_date integer default 0,
+    revision integer default 0,
+    health_state varchar(16) default 'closed',
+    health_failures integer default 0,
+    health_retry_at real default 0,
+    last_error varchar(255) default '',
+    next_due integer default 0
 );
 
 CREATE TABLE blacklist (
     id integer primary key,
     word varchar(255) UNIQUE NOT NULL
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS fingerprints (
+    key varchar(255) primary key,
+    created_at integer NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS fingerprints_created_at_idx ON fingerprints (created_at);
+
+CREATE INDEX IF NOT EXISTS channels_vk_channel_idx ON channels (vk_channel);
+
+CREATE INDEX IF NOT EXISTS channels_telegram_channel_idx ON channels (telegram_channel);
+
+CREATE TABLE IF NOT EXISTS leases (
+    source varchar(255) primary key,
+    worker_id varchar(255) NOT NULL,
+    expires_at real NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS leases_worker_id_idx ON leases (worker_id);
+
+CREATE TABLE IF NOT EXISTS workers (
+    id varchar(255) primary key,
+    heartbeat_at real NOT NULL,
+    sources integer default 0,
+    channels integer default 0,
+    sent integer default 0,
+    failed integer default 0,
+    lag real default 0
+);
+
+CREATE TABLE IF NOT EXISTS worker_tokens (
+    token varchar(64) primary key,
+    worker_id varchar(255) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS flags (
+    name varchar(255) primary key,
+    value integer default 0
+);
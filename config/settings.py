@@ -2,4 +2,81 @@ import os
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "")
 VK_TOKEN = os.getenv("VK_TOKEN", "")
+VK_TOKENS = os.getenv("VK_TOKENS", VK_TOKEN)
 ADMIN_ID = int(os.getenv("ADMIN_ID", 0))
+
+DB_PATH = os.getenv("DB_PATH", "")
+DB_READERS = int(os.getenv("DB_READERS", 2))
+
+VK_API_URL = os.getenv("VK_API_URL", "https://api.vk.com/method")
+VK_API_CONNECTIONS_LIMIT = int(os.getenv("VK_API_CONNECTIONS_LIMIT", 10))
+VK_API_KEEPALIVE_TIMEOUT = int(os.getenv("VK_API_KEEPALIVE_TIMEOUT", 60))
+VK_API_DNS_CACHE_TTL = int(os.getenv("VK_API_DNS_CACHE_TTL", 300))
+VK_API_REQUEST_TIMEOUT = int(os.getenv("VK_API_REQUEST_TIMEOUT", 30))
+
+VK_REQUESTS_PER_SECOND = float(os.getenv("VK_REQUESTS_PER_SECOND", 3))
+VK_REQUESTS_BURST = int(os.getenv("VK_REQUESTS_BURST", 1))
+VK_FLOOD_RETRIES = int(os.getenv("VK_FLOOD_RETRIES", 3))
+VK_EXECUTE_BATCH_SIZE = int(os.getenv("VK_EXECUTE_BATCH_SIZE", 25))
+VK_EXECUTE_BATCH_DELAY = float(os.getenv("VK_EXECUTE_BATCH_DELAY", 1))
+VK_VIDEO_CACHE_SIZE = int(os.getenv("VK_VIDEO_CACHE_SIZE", 5000))
+VK_VIDEO_CACHE_TTL = int(os.getenv("VK_VIDEO_CACHE_TTL", 60 * 60))
+
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", 25))
+SCHEDULER_QUEUE_SIZE = int(os.getenv("SCHEDULER_QUEUE_SIZE", 100))
+
+ADAPTIVE_TIMER_MIN = int(os.getenv("ADAPTIVE_TIMER_MIN", 5))
+ADAPTIVE_TIMER_MAX = int(os.getenv("ADAPTIVE_TIMER_MAX", 24 * 60))
+ADAPTIVE_TIMER_ALPHA = float(os.getenv("ADAPTIVE_TIMER_ALPHA", 0.3))
+
+CONTENT_DEDUP_TTL = int(os.getenv("CONTENT_DEDUP_TTL", 7 * 24 * 60 * 60))
+CONTENT_DEDUP_CACHE_SIZE = int(os.getenv("CONTENT_DEDUP_CACHE_SIZE", 100000))
+
+BLACKLIST_WORD_BOUNDARY = bool(int(os.getenv("BLACKLIST_WORD_BOUNDARY", 0)))
+BLACKLIST_CASE_FOLD = bool(int(os.getenv("BLACKLIST_CASE_FOLD", 1)))
+
+TELEGRAM_SEND_WORKERS = int(os.getenv("TELEGRAM_SEND_WORKERS", 4))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 25))
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", 3))
+TELEGRAM_MAX_PENDING = int(os.getenv("TELEGRAM_MAX_PENDING", 1000))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 5))
+TELEGRAM_DRAIN_TIMEOUT = float(os.getenv("TELEGRAM_DRAIN_TIMEOUT", 10))
+
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", 10))
+
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+VK_CALLBACK_HOST = os.getenv("VK_CALLBACK_HOST", "0.0.0.0")
+VK_CALLBACK_PORT = int(os.getenv("VK_CALLBACK_PORT", 0))
+VK_CALLBACK_PATH = os.getenv("VK_CALLBACK_PATH", "/vk/callback")
+VK_CALLBACK_SECRET = os.getenv("VK_CALLBACK_SECRET", "")
+VK_CALLBACK_CONFIRMATIONS = os.getenv("VK_CALLBACK_CONFIRMATIONS", "")
+VK_LONG_POLL_GROUPS = os.getenv("VK_LONG_POLL_GROUPS", "")
+VK_LONG_POLL_WAIT = int(os.getenv("VK_LONG_POLL_WAIT", 25))
+VK_PUSH_POLL_INTERVAL = int(os.getenv("VK_PUSH_POLL_INTERVAL", 6 * 60))
+
+VK_WALL_COUNT_MIN = int(os.getenv("VK_WALL_COUNT_MIN", 2))
+VK_WALL_COUNT_MAX = int(os.getenv("VK_WALL_COUNT_MAX", 20))
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", 4))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 100))
+
+SHARD_MODE = bool(int(os.getenv("SHARD_MODE", 0)))
+SHARD_WORKER_ID = os.getenv("SHARD_WORKER_ID", "")
+SHARD_LEASE_TTL = float(os.getenv("SHARD_LEASE_TTL", 60))
+SHARD_HEARTBEAT_INTERVAL = float(os.getenv("SHARD_HEARTBEAT_INTERVAL", 10))
+
+VK_TOKEN_DAILY_LIMIT = int(os.getenv("VK_TOKEN_DAILY_LIMIT", 5000))
+VK_TOKEN_DISABLE_TIME = float(os.getenv("VK_TOKEN_DISABLE_TIME", 10 * 60))
+
+VK_BREAKER_THRESHOLD = int(os.getenv("VK_BREAKER_THRESHOLD", 3))
+VK_BREAKER_MAX_BACKOFF = int(os.getenv("VK_BREAKER_MAX_BACKOFF", 24 * 60))
+VK_BREAKER_JITTER = float(os.getenv("VK_BREAKER_JITTER", 0.2))
+
+ADMIN_DIGEST_INTERVAL = float(os.getenv("ADMIN_DIGEST_INTERVAL", 5 * 60))
+ADMIN_DIGEST_SAMPLE = int(os.getenv("ADMIN_DIGEST_SAMPLE", 5))
+
+STARTUP_SPREAD_MAX = int(os.getenv("STARTUP_SPREAD_MAX", 60))
+
+VK_VIDEO_BATCH_DELAY = float(os.getenv("VK_VIDEO_BATCH_DELAY", 0.5))
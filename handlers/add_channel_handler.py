@@ -79,6 +79,8 @@ async def add_channel_steps(message: types.Message, state: FSMContext):
                              parse_mode=ParseMode.MARKDOWN_V2, reply_markup=get_true_false_kb())
     else:
         channel_data = await state.get_data()
-        await controller.add_channel(channel_data)
-        await message.answer(text(f'Successfully added {channel_data["vk_channel"]} channel'),
-                             parse_mode=ParseMode.MARKDOWN_V2, reply_markup=types.ReplyKeyboardRemove())
+        if await controller.add_channel(channel_data):
+            await message.answer(text(f'Successfully added {channel_data["vk_channel"]} channel'),
+                                 parse_mode=ParseMode.MARKDOWN_V2, reply_markup=types.ReplyKeyboardRemove())
+        else:
+            await message.answer('This channel already exists', reply_markup=types.ReplyKeyboardRemove())
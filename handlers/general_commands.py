@@ -15,6 +15,8 @@ async def display_start(message: types.Message):
                          italic('/menu - get bot menu',
                                 '/add - add new channel to parser',
                                 '/blacklist - add word to blacklist',
+                                '/find - find channels by name prefix',
+                                '/stats - get bot metrics',
                                 '/log - get bot log',
                                 '/dump - get bot db dump',
                                 '/load - load last db dump',
@@ -29,7 +31,7 @@ async def send_log_file(message: types.Message):
 
 @dp.message_handler(commands=['dump'])
 async def send_db_dump_file(message: types.Message):
-    db_path = controller.db.create_db_dump()
+    db_path = await controller.db.create_db_dump()
     await message.answer_document(InputFile(db_path))
 
 
@@ -37,16 +39,31 @@ async def send_db_dump_file(message: types.Message):
 async def load_dump(message: types.Message):
     if controller.is_working:
         await controller.stop_parser()
-    controller.db.load_db_dump()
-    controller.parser.blacklist_words = controller.db.get_all_channels()
-    controller.parser.channels = controller.db.get_blacklist_words()
+    await controller.db.load_db_dump()
+    await controller.load()
     await message.answer('Success!')
 
 
+@dp.message_handler(commands=['find'])
+async def find_channels(message: types.Message):
+    prefix = message.get_args().strip().lower().lstrip('@')[:utils.SEARCH_PREFIX_LIMIT]
+    if not prefix:
+        await message.answer('Please send channel name prefix: /find name')
+        return
+    count = await controller.count_channels(prefix)
+    kb = await utils.get_channels_kb(controller, 'channels', prefix=prefix)
+    await message.answer(f'Found {count} channels for "{prefix}"', reply_markup=kb)
+
+
+@dp.message_handler(commands=['stats'])
+async def display_stats(message: types.Message):
+    await message.answer(await utils.get_stats(), parse_mode=ParseMode.MARKDOWN_V2)
+
+
 @dp.message_handler(commands=['menu'])
 async def display_menu(message: types.Message):
     kb = utils.get_menu_kb(controller)
-    status = utils.get_bot_status(controller)
+    status = await utils.get_bot_status(controller)
     await message.answer(status, reply_markup=kb, parse_mode=ParseMode.MARKDOWN_V2)
 
 
@@ -59,7 +76,7 @@ async def process_callback_menu(callback_query: types.CallbackQuery):
     if btn_code.isdigit():
         btn_code = int(btn_code)
     else:
-        await bot.edit_message_text(text=utils.get_bot_status(controller), chat_id=chat_id,
+        await bot.edit_message_text(text=await utils.get_bot_status(controller), chat_id=chat_id,
                                     message_id=message_id, parse_mode=ParseMode.MARKDOWN_V2)
         await bot.edit_message_reply_markup(chat_id, message_id, reply_markup=utils.get_menu_kb(controller))
 
@@ -67,7 +84,7 @@ async def process_callback_menu(callback_query: types.CallbackQuery):
         await controller.toggle_working()
 
     if btn_code == 1 or btn_code == 2:
-        await bot.edit_message_text(text=utils.get_bot_status(controller), chat_id=chat_id,
+        await bot.edit_message_text(text=await utils.get_bot_status(controller), chat_id=chat_id,
                                     message_id=message_id, parse_mode=ParseMode.MARKDOWN_V2)
         await bot.edit_message_reply_markup(chat_id, message_id, reply_markup=utils.get_menu_kb(controller))
     else:
@@ -80,19 +97,17 @@ async def process_callback_channels(callback_query: types.CallbackQuery):
     chat_id = callback_query.message.chat.id
     message_id = callback_query.message.message_id
 
-    query_data = callback_query.data.split('-')
-    if 'page' not in query_data and ''.join(query_data[1:]).isdigit():
-        btn_code = int(query_data[1])
-        kb, formatted_text = utils.get_channel_detail_kb(controller, btn_code)
+    channel_id, cursor, backward, prefix = utils.parse_page_callback(callback_query.data)
+    if channel_id is not None:
+        kb, formatted_text = await utils.get_channel_detail_kb(controller, channel_id)
         await bot.edit_message_text(text=formatted_text, chat_id=chat_id, message_id=message_id,
                                     parse_mode=ParseMode.MARKDOWN_V2)
         await bot.edit_message_reply_markup(chat_id, message_id, reply_markup=kb)
     else:
-        await bot.edit_message_text(text=utils.get_bot_status(controller), chat_id=chat_id,
+        await bot.edit_message_text(text=await utils.get_bot_status(controller), chat_id=chat_id,
                                     message_id=message_id, parse_mode=ParseMode.MARKDOWN_V2)
-        page_num = int(query_data[-1]) if 'page' in callback_query.data else None
-        await bot.edit_message_reply_markup(chat_id, message_id,
-                                            reply_markup=utils.get_channels_kb(controller, 'channels', page_num))
+        kb = await utils.get_channels_kb(controller, 'channels', cursor, backward, prefix)
+        await bot.edit_message_reply_markup(chat_id, message_id, reply_markup=kb)
 
 
 @dp.callback_query_handler(lambda c: c.data and c.data.startswith('edit'))
@@ -101,7 +116,7 @@ async def process_callback_channels(callback_query: types.CallbackQuery):
     message_id = callback_query.message.message_id
 
     _, channel_id, btn_code = callback_query.data.split('-')
-    channel_data = controller.db.get_channel(int(channel_id))
+    channel_data = await controller.get_channel(int(channel_id))
 
     if btn_code.isdigit() and channel_data:
         channel = channel_data[0]
@@ -110,31 +125,28 @@ async def process_callback_channels(callback_query: types.CallbackQuery):
 
         key = accepted_keys.get(btn_code)
         if key:
-            channel.update({key: not channel[key]})
-            await controller.update_channel(channel['id'], channel)
+            await controller.update_channel(channel.id, {key: not getattr(channel, key)})
 
         if btn_code == 98:
-            channel.update({'last_post_id': 0, 'set_last_post_id': 0})
-            await controller.update_channel(channel['id'], channel)
+            await controller.update_channel(channel.id, {'last_post_id': 0, 'set_last_post_id': 0})
         elif btn_code == 97:
             """will set in next channel check"""
-            channel.update({'set_last_post_id': 1})
-            await controller.update_channel(channel['id'], channel)
+            await controller.update_channel(channel.id, {'set_last_post_id': 1})
 
         if not btn_code == 99:
-            kb, formatted_text = utils.get_channel_detail_kb(controller, channel['id'])
+            kb, formatted_text = await utils.get_channel_detail_kb(controller, channel.id)
             await bot.edit_message_text(text=formatted_text, chat_id=chat_id, message_id=message_id,
                                         parse_mode=ParseMode.MARKDOWN_V2)
             await bot.edit_message_reply_markup(chat_id, message_id, reply_markup=kb)
         else:
             await controller.remove_channel(channel)
             await bot.answer_callback_query(callback_query.id, 'Success channel delete!')
-            await bot.edit_message_text(text=utils.get_bot_status(controller), chat_id=chat_id,
+            await bot.edit_message_text(text=await utils.get_bot_status(controller), chat_id=chat_id,
                                         message_id=message_id, parse_mode=ParseMode.MARKDOWN_V2)
             await bot.edit_message_reply_markup(chat_id, message_id, reply_markup=utils.get_menu_kb(controller))
     else:
         await bot.edit_message_reply_markup(chat_id, message_id,
-                                            reply_markup=utils.get_channels_kb(controller, 'channels'))
+                                            reply_markup=await utils.get_channels_kb(controller, 'channels'))
 
 
 @dp.callback_query_handler(lambda c: c.data and c.data.startswith('bl'))
@@ -142,13 +154,11 @@ async def process_callback_channels(callback_query: types.CallbackQuery):
     chat_id = callback_query.message.chat.id
     message_id = callback_query.message.message_id
 
-    query_data = callback_query.data.split('-')
-    if 'page' not in query_data and ''.join(query_data[1:]).isdigit():
-        btn_code = int(query_data[1])
-        await controller.remove_blacklist_word(btn_code)
+    word_id, cursor, backward, prefix = utils.parse_page_callback(callback_query.data)
+    if word_id is not None:
+        await controller.remove_blacklist_word(word_id)
 
-    await bot.edit_message_text(text=utils.get_bot_status(controller), chat_id=chat_id,
+    await bot.edit_message_text(text=await utils.get_bot_status(controller), chat_id=chat_id,
                                 message_id=message_id, parse_mode=ParseMode.MARKDOWN_V2)
-    page_num = int(query_data[-1]) if 'page' in callback_query.data else None
-    await bot.edit_message_reply_markup(chat_id, message_id,
-                                        reply_markup=utils.get_blacklist_kb(controller, 'bl', page_num))
+    kb = await utils.get_blacklist_kb(controller, 'bl', cursor, backward, prefix)
+    await bot.edit_message_reply_markup(chat_id, message_id, reply_markup=kb)
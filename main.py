@@ -1,14 +1,22 @@
 from aiogram import executor
 import handlers
-from misc import dp, logger
+from misc import dp, logger, controller
+
+
+async def on_startup(_):
+    await controller.load()
+
+
+async def on_shutdown(_):
+    await controller.shutdown()
 
 
 if __name__ == '__main__':
     logger.info('Start telegram bot')
-    executor.start_polling(dp, skip_updates=True)
+    executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
 
 # TODO
-#  1. 70% (добавить проверку на уникальность контента) дописать алгоритм для создания задач по проверке новых постов в группах вк
+#  1. DONE (добавить проверку на уникальность контента) дописать алгоритм для создания задач по проверке новых постов в группах вк
 #  2. DONE добавить в стурктуру бд флаг 'Active' для канала
 #  3. DONE (NOT TESTED) добавить функции для удаления и создания тасков для каждого канала по отдельности
 #  5. DONE Отправка в телеграм через aiogram
@@ -17,4 +17,4 @@ bot = Bot(token=settings.TELEGRAM_TOKEN)
 dp = Dispatcher(bot, storage=MemoryStorage())
 dp.middleware.setup(AccessMiddleware(settings.ADMIN_ID, logger))
 
-controller = Controller(settings.VK_TOKEN, bot, logger)
+controller = Controller(settings.VK_TOKENS, bot, logger, coordinator=True)
@@ -1,5 +1,20 @@
+from . import cache
+from . import rate_limiter
+from . import tokens
+from . import registry
+from . import scheduler
+from . import shard
+from . import sender
+from . import state
 from . import api
+from . import blacklist
 from . import controller
 from . import db
+from . import dedup
+from . import digest
+from . import health
+from . import metrics
+from . import pipeline
+from . import push
 from . import vk_parser
 from . import utils
@@ -1,77 +1,422 @@
+import asyncio
 import json
+import ssl
+import time
 from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
 import aiohttp
-import asyncio
-import time
+
+from config.settings import VK_API_CONNECTIONS_LIMIT
+from config.settings import VK_API_DNS_CACHE_TTL
+from config.settings import VK_API_KEEPALIVE_TIMEOUT
+from config.settings import VK_API_REQUEST_TIMEOUT
+from config.settings import VK_API_URL
+from config.settings import VK_EXECUTE_BATCH_DELAY
+from config.settings import VK_EXECUTE_BATCH_SIZE
+from config.settings import VK_FLOOD_RETRIES
+from config.settings import VK_REQUESTS_BURST
+from config.settings import VK_REQUESTS_PER_SECOND
+from config.settings import VK_TOKEN_DAILY_LIMIT
+from config.settings import VK_TOKEN_DISABLE_TIME
+from config.settings import VK_VIDEO_BATCH_DELAY
+from config.settings import VK_VIDEO_CACHE_SIZE
+from config.settings import VK_VIDEO_CACHE_TTL
+from utils.cache import TTLCache
+from utils.metrics import metrics
+from utils.models import Channel
+from utils.tokens import TokenPool
+from utils.tokens import VkToken
+from utils.tokens import parse_tokens
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    try:
+        from msgspec.json import decode as json_loads
+    except ImportError:
+        json_loads = json.loads
+
+
+class VkErrors:
+    """vk api error codes"""
+    no_tokens = -1
+    authorization_failed = 5
+    too_many_requests = 6
+    flood_control = 9
+    rate_limit_reached = 29
+
+
+# errors of access token, not of called method, request failed by them is retried by other token
+TOKEN_ERRORS = {VkErrors.authorization_failed, VkErrors.too_many_requests, VkErrors.flood_control,
+                VkErrors.rate_limit_reached}
 
 
 class ApiUrls:
     """vk api urls"""
-    wall = 'https://api.vk.com/method/wall.get'
-    video = 'https://api.vk.com/method/video.get'
-
-
-class LimitApiRequests:
-    def __init__(self, limit=3):
-        self.requests_per_second = limit
-        self._api_calls = 0
-        self._first_api_call = 0
-
-    def __call__(self, func):
-        """wrapper for api timer"""
-        async def wrapper(*args, **kwargs):
-            await self._check_request_time()
-            result = await func(*args, **kwargs)
-            self._api_calls += 1
-            return result
-        return wrapper
-
-    async def _check_request_time(self):
-        """check request for api limits"""
-        current_time = time.time()
-        self._first_api_call = current_time if self._api_calls == 0 or 1 else self._first_api_call
-        time_reset_limit = self._first_api_call + 1
-        if current_time < time_reset_limit and self.requests_per_second == self._api_calls:
-            await asyncio.sleep(1)
-            self._api_calls = 0
-        elif current_time > time_reset_limit:
-            self._api_calls = 0
+    wall = f'{VK_API_URL}/wall.get'
+    video = f'{VK_API_URL}/video.get'
+    execute = f'{VK_API_URL}/execute'
+    long_poll_server = f'{VK_API_URL}/groups.getLongPollServer'
+
+
+VIDEO_GET_LIMIT = 200
+
+VK_REQUESTS = metrics.counter('vk_requests_total', 'VK api http requests', ('method',))
+VK_ERRORS = metrics.counter('vk_errors_total', 'VK api errors by code, execute errors are counted per method',
+                            ('method', 'code'))
+VK_LATENCY = metrics.histogram('vk_request_duration_seconds', 'VK api http request latency', ('method',))
+VK_LIMITER_WAIT = metrics.histogram('vk_rate_limiter_wait_seconds', 'Time spent waiting for VK rate limiter token')
+VK_TOKEN_REQUESTS = metrics.counter('vk_token_requests_total', 'VK api http requests by token', ('token',))
+VK_TOKEN_DISABLES = metrics.counter('vk_token_disables_total', 'VK tokens pulled out of rotation', ('token', 'code'))
+
+
+class ExecuteBatcher:
+    """collect concurrent calls of one api method and fetch them by single execute request"""
+    max_batch_size = 25
+
+    def __init__(self, api: 'VkApi', method: str, batch_size: int = VK_EXECUTE_BATCH_SIZE,
+                 delay: float = VK_EXECUTE_BATCH_DELAY):
+        self._api = api
+        self.method = method
+        self.batch_size = min(batch_size, self.max_batch_size)
+        self.delay = delay
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def call(self, params: Dict) -> Dict:
+        """add method call to next batch and wait for its own result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((params, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif not self._timer:
+            self._timer = loop.call_later(self.delay, self._flush)
+        return await future
+
+    def _flush(self):
+        """send collected calls by batches"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        pending = [(params, future) for params, future in self._pending if not future.done()]
+        self._pending.clear()
+        for index in range(0, len(pending), self.batch_size):
+            task = asyncio.get_running_loop().create_task(self._execute(pending[index:index + self.batch_size]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def cancel(self):
+        """drop calls waiting for next batch and batches in flight"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        [future.cancel() for _, future in self._pending]
+        self._pending.clear()
+        [task.cancel() for task in self._tasks]
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def build_code(self, calls: List[Dict]) -> str:
+        """build vkscript code returning list of method results"""
+        api_calls = ','.join(f'API.{self.method}({json.dumps(params, ensure_ascii=False)})' for params in calls)
+        return f'return [{api_calls}];'
+
+    @staticmethod
+    def split_response(response: Dict, count: int) -> List[Dict]:
+        """split execute response into separate method responses"""
+        if 'error' in response:
+            return [{'error': response['error']} for _ in range(count)]
+        items = response.get('response') or []
+        items = items + [False] * (count - len(items))
+        errors = iter(response.get('execute_errors', []))
+        results = []
+        for item in items[:count]:
+            if item is False or item is None:
+                error = next(errors, {'error_code': 0, 'error_msg': 'Unknown execute error'})
+                results.append({'error': error})
+            else:
+                results.append({'response': item})
+        return results
+
+    async def _execute(self, batch: List):
+        """fetch batch and set result for every waiting call
+
+        calls failed inside execute by token errors are passed to token pool and sent again by other token
+        """
+        for attempt in range(VK_FLOOD_RETRIES + 1):
+            try:
+                response, token = await self._api._fetch_by_token(
+                    ApiUrls.execute, {'code': self.build_code([p for p, _ in batch])}, quota=(self.method, len(batch)))
+            except asyncio.CancelledError:
+                [future.cancel() for _, future in batch]
+                raise
+            except Exception as error:
+                [future.set_exception(error) for _, future in batch if not future.done()]
+                return
+            retry_batch = []
+            token_errors = set()
+            for (params, future), result in zip(batch, self.split_response(response, len(batch))):
+                if 'error' in result and 'error' not in response:
+                    error_code = result['error'].get('error_code')
+                    VK_ERRORS.inc(self.method, str(error_code))
+                    if token and error_code in TOKEN_ERRORS and attempt < VK_FLOOD_RETRIES:
+                        token_errors.add(error_code)
+                        retry_batch.append((params, future))
+                        continue
+                if not future.done():
+                    future.set_result(result)
+            [self._api._handle_token_error(token, self.method, error_code) for error_code in token_errors]
+            batch = [(params, future) for params, future in retry_batch if not future.done()]
+            if not batch:
+                return
+
+
+class VideoBatcher:
+    """collect video ids of sources fetched at same time and get them by shared video.get calls
+
+    every requested id has one future until its batch is done, so source queued for processing waits for
+    ids requested by its fetch instead of requesting them again
+    """
+    def __init__(self, api: 'VkApi', batch_size: int = VIDEO_GET_LIMIT, delay: float = VK_VIDEO_BATCH_DELAY):
+        self._api = api
+        self.batch_size = min(batch_size, VIDEO_GET_LIMIT)
+        self.delay = delay
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._pending: List[str] = []
+        self._timer = None
+        self._tasks = set()
+
+    def request(self, video_ids: List[str]) -> List[asyncio.Future]:
+        """add not requested video ids to next batch and get futures of all ids"""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for video_id in video_ids:
+            future = self._futures.get(video_id)
+            if future is None:
+                future = self._futures[video_id] = loop.create_future()
+                future.add_done_callback(lambda done: done.cancelled() or done.exception())
+                self._pending.append(video_id)
+            futures.append(future)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._pending and not self._timer:
+            self._timer = loop.call_later(self.delay, self._flush)
+        return futures
+
+    async def call(self, video_ids: List[str]) -> Dict[str, Dict]:
+        """get found videos by ids"""
+        video_ids = list(dict.fromkeys(video_ids))
+        futures = self.request(video_ids)
+        if futures:
+            await asyncio.wait(futures)
+        videos = {video_id: future.result() for video_id, future in zip(video_ids, futures)}
+        return {video_id: video for video_id, video in videos.items() if video is not None}
+
+    def _flush(self):
+        """request collected video ids by batches"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        pending = self._pending
+        self._pending = []
+        for index in range(0, len(pending), self.batch_size):
+            task = asyncio.get_running_loop().create_task(self._get(pending[index:index + self.batch_size]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _get(self, video_ids: List[str]):
+        """get batch of videos, cache found ones and set result of every id, not found video is None"""
+        futures = [self._futures.pop(video_id) for video_id in video_ids]
+        try:
+            data = {'videos': ','.join(video_ids), 'count': len(video_ids), 'extended': 1}
+            response = await self._api._fetch(ApiUrls.video, data)
+        except asyncio.CancelledError:
+            [future.cancel() for future in futures]
+            raise
+        except Exception as error:
+            [future.set_exception(error) for future in futures if not future.done()]
+            return
+        items = {f"{item['owner_id']}_{item['id']}": item
+                 for item in (response.get('response') or {}).get('items', [])}
+        for video_id, future in zip(video_ids, futures):
+            video = items.get('_'.join(video_id.split('_')[:2]))
+            if video is not None:
+                self._api.video_cache.set(video_id, video)
+            if not future.done():
+                future.set_result(video)
+
+    async def cancel(self):
+        """drop ids waiting for next batch and batches in flight"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        [self._futures.pop(video_id).cancel() for video_id in self._pending]
+        self._pending = []
+        [task.cancel() for task in self._tasks]
+        await asyncio.gather(*self._tasks, return_exceptions=True)
 
 
 class VkApi:
     """provide vk api methods to get wall posts and video data"""
-    def __init__(self, access_token: str):
-        self._access_token = access_token
+    def __init__(self, access_token: Union[str, List[str]], connections_limit: int = VK_API_CONNECTIONS_LIMIT,
+                 keepalive_timeout: int = VK_API_KEEPALIVE_TIMEOUT, dns_cache_ttl: int = VK_API_DNS_CACHE_TTL,
+                 request_timeout: int = VK_API_REQUEST_TIMEOUT):
+        self.tokens = TokenPool(parse_tokens(access_token), VK_REQUESTS_PER_SECOND, VK_REQUESTS_BURST,
+                                VK_TOKEN_DAILY_LIMIT, VK_TOKEN_DISABLE_TIME)
+        self._connections_limit = connections_limit
+        self._keepalive_timeout = keepalive_timeout
+        self._dns_cache_ttl = dns_cache_ttl
+        self._request_timeout = request_timeout
+        self._session = None
+        self.wall_batcher = ExecuteBatcher(self, 'wall.get')
+        self.video_batcher = VideoBatcher(self)
+        self.video_cache = TTLCache(VK_VIDEO_CACHE_SIZE, VK_VIDEO_CACHE_TTL)
+        self.connection_stats = {'requests': 0, 'created': 0, 'reused': 0}
+
+    async def _on_connection_create(self, session, context, params):
+        """count new tcp connections"""
+        self.connection_stats['created'] += 1
+
+    async def _on_connection_reuse(self, session, context, params):
+        """count reused keep-alive connections"""
+        self.connection_stats['reused'] += 1
+
+    async def open_session(self):
+        """open pooled http session shared by all api requests"""
+        if self._session and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(ssl=ssl.create_default_context(), limit_per_host=self._connections_limit,
+                                         keepalive_timeout=self._keepalive_timeout, use_dns_cache=True,
+                                         ttl_dns_cache=self._dns_cache_ttl)
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+        self._session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config],
+                                              timeout=aiohttp.ClientTimeout(total=self._request_timeout))
+
+    async def close_session(self):
+        """close pooled http session"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     @staticmethod
     async def _response_to_dict(data: aiohttp.ClientResponse) -> Dict:
-        """convert vk response raw json to dict"""
-        raw = await data.read()
-        return json.loads(raw.decode('utf-8'))
+        """convert vk response raw json bytes to dict without decoding body to str"""
+        return json_loads(await data.read())
 
     async def _get_post_response(self, session: aiohttp.ClientSession, url: str, data: Dict = None) -> Dict:
         """get response from post request"""
         data = dict() if not data else data
-        data['access_token'] = self._access_token
         data['v'] = '5.120'
         async with session.post(url, data=data) as response:
             assert response.status == 200
             return await self._response_to_dict(response)
 
-    @LimitApiRequests(limit=3)
-    async def _fetch(self, url: str, data: Dict = None) -> Dict:
-        """get response from requested url"""
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-            response = await self._get_post_response(session, url, data)
-            return response
-
-    async def get_wall_posts(self, channel: Dict, count: int = 5) -> Dict:
-        """get vk wall posts"""
-        data = {'domain': channel['vk_channel'], 'count': count, 'filter': 'owner'}
-        return await self._fetch(ApiUrls.wall, data)
-
-    async def get_video_data(self, video_id: str) -> Dict:
-        """get video links"""
-        data = {'videos': video_id, 'count': 1, 'extended': 1}
-        return await self._fetch(ApiUrls.video, data)
+    def _handle_token_error(self, token, method: str, error_code) -> bool:
+        """pull token out on auth and flood errors, return True when request should be retried by other token"""
+        if error_code == VkErrors.too_many_requests:
+            token.rate_limiter.penalize()
+        elif error_code == VkErrors.rate_limit_reached:
+            token.exhaust(method)
+        elif error_code in (VkErrors.authorization_failed, VkErrors.flood_control):
+            token.disable(self.tokens.disable_time, f'error {error_code}', time.time())
+        else:
+            token.rate_limiter.reset_backoff()
+            return False
+        token.errors += 1
+        VK_TOKEN_DISABLES.inc(token.name, str(error_code))
+        return True
+
+    async def _acquire_token(self, method: str):
+        """wait for rate limiter of token with most headroom, token pulled out while waiting is replaced"""
+        started_at = time.monotonic()
+        token = self.tokens.choose(method)
+        while token is not None:
+            await token.rate_limiter.acquire()
+            if token.is_available(method, time.time()):
+                break
+            token = self.tokens.choose(method)
+        VK_LIMITER_WAIT.observe(time.monotonic() - started_at)
+        return token
+
+    async def _fetch(self, url: str, data: Dict = None, quota: Tuple[str, int] = None) -> Dict:
+        """get response from requested url by token with most headroom
+
+        quota is (method, calls) counted against token daily limits, execute passes its inner method,
+        request is retried by other token on auth or flood errors, access token in data skips the pool
+        """
+        response, _ = await self._fetch_by_token(url, data, quota)
+        return response
+
+    async def _fetch_by_token(self, url: str, data: Dict = None,
+                              quota: Tuple[str, int] = None) -> Tuple[Dict, Optional[VkToken]]:
+        """get response and token of pool which got it, token is None for own or missing token"""
+        if not self._session or self._session.closed:
+            await self.open_session()
+        data = dict(data or {})
+        method = url.rsplit('/', 1)[-1]
+        quota_method, calls = quota or (method, 1)
+        own_token = 'access_token' in data
+        response = {'error': {'error_code': VkErrors.no_tokens, 'error_msg': 'No available vk tokens'}}
+        token = None
+        for _ in range(VK_FLOOD_RETRIES + 1):
+            token = None
+            if not own_token:
+                token = await self._acquire_token(quota_method)
+                if token is None:
+                    break
+                token.record(quota_method, calls)
+                VK_TOKEN_REQUESTS.inc(token.name)
+                data['access_token'] = token.access_token
+            requested_at = time.monotonic()
+            self.connection_stats['requests'] += 1
+            VK_REQUESTS.inc(method)
+            try:
+                response = await self._get_post_response(self._session, url, data)
+            except Exception as error:
+                VK_ERRORS.inc(method, type(error).__name__)
+                raise
+            finally:
+                VK_LATENCY.observe(time.monotonic() - requested_at, method)
+            if 'error' in response:
+                VK_ERRORS.inc(method, str(response['error'].get('error_code')))
+            error_code = response.get('error', {}).get('error_code')
+            if not token or not self._handle_token_error(token, quota_method, error_code):
+                break
+        return response, token
+
+    async def get_wall_posts(self, channel: Channel, count: int = 5) -> Dict:
+        """get vk wall posts, requests from different channels are batched by execute"""
+        data = {'domain': channel.vk_channel, 'count': count, 'filter': 'owner'}
+        return await self.wall_batcher.call(data)
+
+    @staticmethod
+    def get_video_id(video: Dict) -> str:
+        """get video id in owner_id_id_access_key format"""
+        video_id = f"{video['owner_id']}_{video['id']}"
+        return f"{video_id}_{video['access_key']}" if video.get('access_key') else video_id
+
+    async def get_videos(self, video_ids: List[str]) -> Dict[str, Dict]:
+        """get video items by ids, not cached videos of concurrently processed sources share video.get calls"""
+        videos = {}
+        missing_ids = []
+        for video_id in dict.fromkeys(video_ids):
+            video = self.video_cache.get(video_id)
+            if video is None:
+                missing_ids.append(video_id)
+            else:
+                videos[video_id] = video
+        if missing_ids:
+            videos.update(await self.video_batcher.call(missing_ids))
+        return videos
+
+    async def get_video(self, video_id: str) -> Dict:
+        """get video item by id"""
+        videos = await self.get_videos([video_id])
+        return videos.get(video_id, {})
 
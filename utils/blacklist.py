@@ -0,0 +1,71 @@
+from collections import deque
+from typing import Iterable
+from typing import Optional
+
+
+class BlacklistMatcher:
+    """aho-corasick automaton matching all blacklist words by one pass over text"""
+    def __init__(self, words: Iterable[str] = (), word_boundary: bool = False, case_fold: bool = True):
+        self.word_boundary = word_boundary
+        self.case_fold = case_fold
+        self.words = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        self.build(words)
+
+    def __len__(self):
+        return len(self.words)
+
+    def _normalize(self, text: str) -> str:
+        return text.casefold() if self.case_fold else text
+
+    def build(self, words: Iterable[str]):
+        """compile words to automaton"""
+        self.words = list(dict.fromkeys(self._normalize(word) for word in words if word))
+        goto, fail, output = [{}], [0], [()]
+        for word in self.words:
+            state = 0
+            for char in word:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    goto.append({})
+                    fail.append(0)
+                    output.append(())
+                    next_state = goto[state][char] = len(goto) - 1
+                state = next_state
+            output[state] += (len(word),)
+
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fail_state = fail[state]
+                while fail_state and char not in goto[fail_state]:
+                    fail_state = fail[fail_state]
+                fail[next_state] = goto[fail_state].get(char, 0)
+                output[next_state] += output[fail[next_state]]
+        self._goto, self._fail, self._output = goto, fail, output
+
+    @staticmethod
+    def _is_word_char(text: str, index: int) -> bool:
+        return 0 <= index < len(text) and (text[index].isalnum() or text[index] == '_')
+
+    def search(self, text: str) -> Optional[str]:
+        """get first blacklist word found in text"""
+        if not self.words or not text:
+            return None
+        text = self._normalize(text)
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length in output[state]:
+                start = index - length + 1
+                if not self.word_boundary or not (self._is_word_char(text, start - 1) or
+                                                  self._is_word_char(text, index + 1)):
+                    return text[start:index + 1]
+        return None
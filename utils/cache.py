@@ -0,0 +1,43 @@
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import Callable
+from typing import Hashable
+
+
+class TTLCache:
+    """lru cache with expiring items"""
+    def __init__(self, max_size: int = 1000, ttl: float = 3600, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._items = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """get not expired item and mark it as recently used"""
+        item = self._items.get(key)
+        if item is None or item[0] < self._clock():
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        """set item and drop least recently used items over max size"""
+        self._items[key] = (self._clock() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        """remove all items"""
+        self._items.clear()
@@ -1,18 +1,69 @@
+import time
+from dataclasses import replace
 from typing import Dict
+from typing import List
+from typing import Union
 
+from config.settings import METRICS_HOST
+from config.settings import METRICS_PORT
+from config.settings import SHARD_HEARTBEAT_INTERVAL
+from config.settings import SHARD_LEASE_TTL
+from config.settings import SHARD_MODE
+from config.settings import SHARD_WORKER_ID
+from utils.cache import TTLCache
+from utils.health import HEALTHY_FIELDS
+from utils.metrics import MetricsServer
+from utils.metrics import metrics
+from utils.models import Channel
+from utils.shard import PAUSED_FLAG
+from utils.shard import ShardWorker
+from utils.vk_parser import CHANNEL_DELIVERY_LAG
 from utils.vk_parser import VkParser
 
 
 class Controller:
-    def __init__(self, access_token: str, telegram_bot, logger):
+    """bot facade of parser, in shard mode bot is coordinator which only pauses and resumes shard workers"""
+    def __init__(self, access_token: Union[str, List[str]], telegram_bot, logger, sharded: bool = SHARD_MODE,
+                 coordinator: bool = False):
         self.parser = VkParser(access_token, telegram_bot, logger)
         self.db = self.parser.db
+        self.channels = self.parser.channels
+        self._counts_cache = TTLCache(100, 60)
+        self.metrics_server = MetricsServer(metrics, METRICS_PORT, METRICS_HOST, logger)
+        self.sharded = sharded
+        self.coordinator = sharded and coordinator
+        self.shard = None
+        if sharded and not coordinator:
+            self.shard = ShardWorker(self.parser, self.db, SHARD_WORKER_ID, SHARD_LEASE_TTL, SHARD_HEARTBEAT_INTERVAL,
+                                     logger)
         self.logger = logger
         self.is_working = False
 
+    async def load(self):
+        """load parser data from db and start metrics server"""
+        await self.parser.load()
+        await self.metrics_server.start()
+        if self.coordinator:
+            await self.update_fleet_state()
+
+    async def update_fleet_state(self):
+        """read shard workers state, coordinator is working while workers are not paused"""
+        self.is_working = not await self.db.get_flag(PAUSED_FLAG)
+
+    async def shutdown(self):
+        """stop parser, metrics server and close db"""
+        await self.stop_parser()
+        await self.metrics_server.stop()
+        self.db.close()
+
     async def toggle_working(self):
-        """toggle parser working"""
-        if self.is_working:
+        """toggle parser working, coordinator pauses or resumes all shard workers by db flag"""
+        if self.coordinator:
+            paused = not await self.db.get_flag(PAUSED_FLAG)
+            await self.db.set_flag(PAUSED_FLAG, int(paused))
+            self.is_working = not paused
+            self.logger.info('Shard workers paused' if paused else 'Shard workers resumed')
+        elif self.is_working:
             await self.stop_parser()
             self.logger.info('Parser stopped')
         else:
@@ -20,53 +71,121 @@ class Controller:
             self.logger.info('Parser successfully started')
 
     async def start_parser(self):
-        """start parser"""
-        if not self.is_working:
-            await self.parser.run()
+        """start parser, shard worker checks only sources leased by this process with its own vk tokens"""
+        if not self.is_working and not self.coordinator:
+            if self.shard:
+                await self.shard.claim_tokens()
+            await self.parser.run(schedule_channels=not self.shard)
+            if self.shard:
+                await self.shard.start()
             self.is_working = True
 
     async def stop_parser(self):
-        """stop parser"""
+        """stop parser, not saved channels state is flushed to db and shard leases are released"""
+        if self.coordinator:
+            return
         await self.parser.stop()
+        await self.parser.state.flush()
+        if self.shard:
+            await self.shard.stop()
         self.is_working = False
 
+    async def get_channel(self, row_id: int) -> List[Channel]:
+        """get copy of channel with current parser state, sharded state is read from db"""
+        if self.sharded:
+            return await self.db.get_channel(row_id)
+        channel = self.channels.get(row_id)
+        return [replace(channel)] if channel else []
+
+    async def get_workers(self) -> List[Dict]:
+        """get live shard workers stats"""
+        return await self.db.get_workers(time.time() - SHARD_LEASE_TTL)
+
+    async def count_channels(self, prefix: str = '') -> int:
+        """count channels filtered by name prefix, filtered counts are cached"""
+        if not prefix:
+            return len(self.channels)
+        count = self._counts_cache.get(prefix)
+        if count is None:
+            count = await self.db.count_channels(prefix)
+            self._counts_cache.set(prefix, count)
+        return count
+
     async def add_channel(self, channel_data: Dict):
         """add channel to db and create parse task"""
-        self.db.add_channel(channel_data)
-        db_channel_data = self.db.get_channel_by_tg_vk_channel_key(channel_data['telegram_channel'],
-                                                                   channel_data['vk_channel'])
-        if self.is_working and db_channel_data and db_channel_data[0]['is_active']:
-            await self.parser.create_channel_task(db_channel_data[0])
+        if self.channels.get_by_key(channel_data['telegram_channel'], channel_data['vk_channel']):
+            return False
+        await self.db.add_channel(channel_data)
+        db_channel_data = await self.db.get_channel_by_tg_vk_channel_key(channel_data['telegram_channel'],
+                                                                         channel_data['vk_channel'])
+        if db_channel_data:
+            self.channels.add(db_channel_data[0])
+        self._counts_cache.clear()
+        if self.is_working and not self.sharded and db_channel_data and db_channel_data[0].is_active:
+            await self.parser.schedule_channel(db_channel_data[0])
         self.logger.info(f'Add new channel {channel_data["vk_channel"]} -> {channel_data["telegram_channel"]}')
+        return True
 
-    async def remove_channel(self, channel_data: Dict):
-        """remove channel from db and stop task"""
-        self.db.delete_channel(channel_data['id'])
-        await self.parser.close_channel_task(channel_data['id'])
-        self.logger.info(f'Remove channel {channel_data["vk_channel"]} -> {channel_data["telegram_channel"]} from db')
+    async def remove_channel(self, channel_data: Channel):
+        """remove channel from db and scheduler"""
+        await self.db.delete_channel(channel_data.id)
+        self.channels.remove(channel_data.id)
+        self._counts_cache.clear()
+        self.parser.state.discard(channel_data.id)
+        await self.parser.unschedule_channel(channel_data.id)
+        self._remove_delivery_lag(channel_data.telegram_channel)
+        self.logger.info(f'Remove channel {channel_data.vk_channel} -> {channel_data.telegram_channel} from db')
 
     async def update_channel(self, row_id: int, channel_data: Dict):
-        """update channel info and restart task"""
-        self.db.update_channel(row_id, channel_data)
-        await self.parser.close_channel_task(row_id)
+        """update changed channel fields and reschedule its check, shard workers reschedule it by revision
+
+        fields are set on loaded channel object, so check running meanwhile keeps moving last post id of
+        the scheduled channel, enabled channel starts with closed circuit breaker
+        """
+        if channel_data.get('is_active'):
+            channel_data = {**channel_data, **HEALTHY_FIELDS}
+        await self.parser.state.flush()
+        await self.db.update_channel(row_id, channel_data)
+
+        db_channel_data = await self.db.get_channel(row_id)
+        channel = self.channels.get(row_id)
+        old_telegram_channel = channel.telegram_channel if channel else None
+        if channel and db_channel_data:
+            self.channels.remove(row_id)
+            if channel_data.get('vk_channel', channel.vk_channel) != channel.vk_channel:
+                await self.parser.unschedule_channel(row_id)
+            for key, value in channel_data.items():
+                setattr(channel, key, value)
+            channel.revision = db_channel_data[0].revision
+            self.channels.add(channel)
+        elif db_channel_data:
+            channel = db_channel_data[0]
+            self.channels.add(channel)
+        if not self.sharded:
+            if self.is_working and channel and channel.is_active:
+                await self.parser.schedule_channel(channel)
+            else:
+                await self.parser.unschedule_channel(row_id)
+        if old_telegram_channel and channel and channel.telegram_channel != old_telegram_channel:
+            self._remove_delivery_lag(old_telegram_channel)
+        self.logger.info(f'Updated channel (id: {row_id}) params: {", ".join(channel_data)}')
 
-        db_channel_data = self.db.get_channel(row_id)
-        if self.is_working and db_channel_data and db_channel_data[0]['is_active']:
-            await self.parser.create_channel_task(db_channel_data[0])
-        self.logger.info(f'Updated {channel_data["vk_channel"]} (id: {channel_data["id"]}) params')
+    def _remove_delivery_lag(self, telegram_channel: str):
+        """drop delivery lag metric of telegram channel which is not target of any channel"""
+        if not any(channel.telegram_channel == telegram_channel for channel in self.channels):
+            CHANNEL_DELIVERY_LAG.remove(telegram_channel)
 
     async def add_blacklist_word(self, word: str):
         """add blacklist word to db and parser"""
-        black_list_words = self.db.get_blacklist_words()
+        black_list_words = await self.db.get_blacklist_words()
         if word.lower() not in black_list_words:
-            self.db.add_blacklist_word(word.lower())
-            self.parser.blacklist_words.append(word.lower())
+            await self.db.add_blacklist_word(word.lower())
+            self.parser.set_blacklist_words(self.parser.blacklist_words + [word.lower()])
             self.logger.info(f'Add "{word}" word to blacklist')
             return True
 
     async def remove_blacklist_word(self, row_id: int):
         """remove blacklist word from db and parser"""
-        self.db.delete_blacklist_word(row_id)
-        black_list_words = self.db.get_blacklist_words()
-        self.parser.blacklist_words = black_list_words
+        await self.db.delete_blacklist_word(row_id)
+        self.parser.set_blacklist_words(await self.db.get_blacklist_words())
         self.logger.info(f'Removed word from blacklist')
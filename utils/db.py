@@ -1,19 +1,62 @@
+import asyncio
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 import sqlite3
 
 from typing import Dict, List, Tuple
 
+from config.settings import DB_PATH
+from config.settings import DB_READERS
+from utils.models import CHANNEL_COLUMNS
+from utils.models import Channel
+
 
 PATH = os.path.dirname(os.path.dirname(__file__))
+CHANNEL_SELECT = ', '.join(f'channels.{column}' for column in CHANNEL_COLUMNS)
+
+CHANNEL_MIGRATIONS = {
+    'adaptive_timer': 'boolean default false',
+    'post_interval': 'real default 0',
+    'last_post_date': 'integer default 0',
+    'revision': 'integer default 0',
+    'health_state': "varchar(16) default 'closed'",
+    'health_failures': 'integer default 0',
+    'health_retry_at': 'real default 0',
+    'last_error': "varchar(255) default ''",
+    'next_due': 'integer default 0',
+}
+
+TABLE_MIGRATIONS = (
+    "CREATE TABLE IF NOT EXISTS fingerprints (key varchar(255) primary key, created_at integer NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS fingerprints_created_at_idx ON fingerprints (created_at)",
+    "CREATE INDEX IF NOT EXISTS channels_vk_channel_idx ON channels (vk_channel)",
+    "CREATE INDEX IF NOT EXISTS channels_telegram_channel_idx ON channels (telegram_channel)",
+    "CREATE TABLE IF NOT EXISTS leases (source varchar(255) primary key, worker_id varchar(255) NOT NULL, "
+    "expires_at real NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS leases_worker_id_idx ON leases (worker_id)",
+    "CREATE TABLE IF NOT EXISTS workers (id varchar(255) primary key, heartbeat_at real NOT NULL, "
+    "sources integer default 0, channels integer default 0, sent integer default 0, failed integer default 0, "
+    "lag real default 0)",
+    "CREATE TABLE IF NOT EXISTS worker_tokens (token varchar(64) primary key, worker_id varchar(255) NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS flags (name varchar(255) primary key, value integer default 0)",
+)
 
 
 class DbController:
-    def __init__(self):
-        self._connection = sqlite3.connect(os.path.join(PATH, 'db', 'channels.db'))
+    def __init__(self, path: str = DB_PATH, read_only: bool = False):
+        self._connection = sqlite3.connect(path or os.path.join(PATH, 'db', 'channels.db'), cached_statements=256,
+                                           check_same_thread=False)
         self._cursor = self._connection.cursor()
+        self._cursor.execute("PRAGMA busy_timeout = 5000")
 
-        self._check_db_exists()
+        if not read_only:
+            self._cursor.execute("PRAGMA journal_mode = WAL")
+            self._cursor.execute("PRAGMA synchronous = NORMAL")
+            self._check_db_exists()
+            self._migrate_db()
 
         self._channel_columns = self._get_channel_columns()
 
@@ -32,23 +75,37 @@ class DbController:
         with self._connection:
             self._cursor.executescript(sql_data)
 
+    def _migrate_db(self):
+        """add columns missing in db created by previous versions"""
+        self._cursor.execute("PRAGMA table_info('channels')")
+        columns = {row[1] for row in self._cursor.fetchall()}
+        with self._connection:
+            for column, definition in CHANNEL_MIGRATIONS.items():
+                if column not in columns:
+                    self._cursor.execute(f"ALTER TABLE channels ADD COLUMN {column} {definition}")
+            for statement in TABLE_MIGRATIONS:
+                self._cursor.execute(statement)
+
     def _get_channel_columns(self) -> Tuple:
         """get channel table columns names"""
 
-        self._cursor.execute("SELECT * FROM 'channels'")
+        self._cursor.execute("SELECT * FROM 'channels' LIMIT 0")
         columns = tuple(map(lambda row: row[0], self._cursor.description))
         return columns
 
+    def _get_columns(self) -> Tuple:
+        """get columns names of last query"""
+        return tuple(map(lambda row: row[0], self._cursor.description))
+
     @staticmethod
     def _rows_to_dict(rows: List[Tuple], columns: Tuple) -> List[Dict]:
         """convert sql row tuple to dict"""
-        channels = []
-        for row in rows:
-            row_dict = {}
-            for index, column in enumerate(columns):
-                row_dict[column] = row[index]
-            channels.append(row_dict)
-        return channels
+        return [dict(zip(columns, row)) for row in rows]
+
+    def _select_channels(self, condition: str = '', params: Tuple = (), join: str = '') -> List[Channel]:
+        """get channels rows filtered by condition as channel models"""
+        self._cursor.execute(f"SELECT {CHANNEL_SELECT} from channels {join} {condition}", params)
+        return Channel.from_rows(self._cursor.fetchall())
 
     def _insert(self, table: str, column_values: Dict):
         """insert values to selected table"""
@@ -61,7 +118,7 @@ class DbController:
     def _delete(self, table: str, row_id: int):
         """delete row from selected table"""
         with self._connection:
-            self._cursor.execute(f"delete from '{table}' where id={row_id}")
+            self._cursor.execute(f"delete from '{table}' where id = ?", (row_id,))
 
     def _fetch(self, table: str, columns: List[str] = ''):
         """get columns from selected table"""
@@ -70,28 +127,55 @@ class DbController:
         rows = self._cursor.fetchall()
         return rows
 
+    def _fetch_page(self, table: str, columns: List[str], search_columns: List[str], after_id: int = 0,
+                    limit: int = 5, prefix: str = '', backward: bool = False) -> List[Dict]:
+        """get rows page by id keyset, backward page is fetched before after_id, prefix filters search columns"""
+        conditions = ['id < ?' if backward else 'id > ?']
+        params = [after_id]
+        if prefix:
+            conditions.append(f"({' OR '.join(f'({column} >= ? AND {column} < ?)' for column in search_columns)})")
+            params.extend([prefix, f'{prefix}\uffff'] * len(search_columns))
+        self._cursor.execute(f"SELECT {', '.join(['id', *columns])} from '{table}' "
+                             f"where {' AND '.join(conditions)} ORDER BY id {'DESC' if backward else 'ASC'} LIMIT ?",
+                             (*params, limit))
+        rows = self._rows_to_dict(self._cursor.fetchall(), self._get_columns())
+        return rows[::-1] if backward else rows
+
+    def _count(self, table: str, search_columns: List[str], prefix: str = '') -> int:
+        """count rows filtered by search columns prefix"""
+        if not prefix:
+            self._cursor.execute(f"SELECT count(*) from '{table}'")
+        else:
+            conditions = ' OR '.join(f'({column} >= ? AND {column} < ?)' for column in search_columns)
+            self._cursor.execute(f"SELECT count(*) from '{table}' where {conditions}",
+                                 [prefix, f'{prefix}\uffff'] * len(search_columns))
+        return self._cursor.fetchone()[0]
+
     def get_cursor(self):
         """get db cursor"""
         return self._cursor
 
-    def get_all_channels(self) -> List[Dict]:
+    def get_all_channels(self) -> List[Channel]:
         """get all channels rows from db"""
-        rows = self._fetch('channels')
-        channels = self._rows_to_dict(rows, self._channel_columns)
-        return channels
+        return self._select_channels()
 
-    def get_channel(self, row_id: int) -> List[Dict]:
+    def get_channel(self, row_id: int) -> List[Channel]:
         """get channel by row from db"""
-        self._cursor.execute(f"SELECT * from 'channels' where id='{row_id}'")
-        rows = self._cursor.fetchall()
-        return self._rows_to_dict(rows, self._channel_columns)
+        return self._select_channels("where id = ?", (row_id,))
 
-    def get_channel_by_tg_vk_channel_key(self, telegram_channel: str, vk_channel: str):
+    def get_channel_by_tg_vk_channel_key(self, telegram_channel: str, vk_channel: str) -> List[Channel]:
         """get channel row from db filtered by telegram_channel and vk_channel key"""
-        self._cursor.execute(f"SELECT * from 'channels' where telegram_channel='{telegram_channel}' "
-                             f"and vk_channel='{vk_channel}'")
-        rows = self._cursor.fetchall()
-        return self._rows_to_dict(rows, self._channel_columns)
+        return self._select_channels("where telegram_channel = ? and vk_channel = ?", (telegram_channel, vk_channel))
+
+    def get_channels_page(self, after_id: int = 0, limit: int = 5, prefix: str = '',
+                          backward: bool = False) -> List[Dict]:
+        """get channels page filtered by vk or telegram channel prefix"""
+        return self._fetch_page('channels', ['vk_channel', 'telegram_channel'], ['vk_channel', 'telegram_channel'],
+                                after_id, limit, prefix, backward)
+
+    def count_channels(self, prefix: str = '') -> int:
+        """count channels filtered by vk or telegram channel prefix"""
+        return self._count('channels', ['vk_channel', 'telegram_channel'], prefix)
 
     def add_channel(self, channel_data: Dict):
         """add channel row to channels table"""
@@ -102,11 +186,26 @@ class DbController:
         self._delete('channels', row_id)
 
     def update_channel(self, row_id: int, channel_data: Dict):
-        """update channel row in channels table"""
+        """update channel row in channels table and increase its revision for shard workers"""
+        channel_data = {key: value for key, value in channel_data.items()
+                        if key in self._channel_columns and key != 'revision'}
         with self._connection:
             keys = ', '.join(map(lambda x: f'{x} = ?', channel_data.keys()))
             values = tuple(channel_data.values())
-            self._cursor.execute(f"UPDATE channels SET {keys} WHERE id = {row_id}", values)
+            self._cursor.execute(f"UPDATE channels SET {keys}, revision = revision + 1 WHERE id = ?",
+                                 (*values, row_id))
+
+    def update_channels_fields(self, channels_fields: Dict[int, Dict]):
+        """update changed fields of many channels in one transaction, rows with same fields are batched"""
+        batches = {}
+        for row_id, fields in channels_fields.items():
+            fields = {key: value for key, value in fields.items() if key in self._channel_columns}
+            if fields:
+                batches.setdefault(tuple(fields.keys()), []).append((*fields.values(), row_id))
+        with self._connection:
+            for columns, rows in batches.items():
+                keys = ', '.join(map(lambda x: f'{x} = ?', columns))
+                self._cursor.executemany(f"UPDATE channels SET {keys} WHERE id = ?", rows)
 
     def get_blacklist_words(self, get_id=False) -> List:
         """get all blacklist words from blacklist table"""
@@ -117,6 +216,11 @@ class DbController:
             return words_dict
         return words
 
+    def get_blacklist_page(self, after_id: int = 0, limit: int = 5, prefix: str = '',
+                           backward: bool = False) -> List[Dict]:
+        """get blacklist words page filtered by word prefix"""
+        return self._fetch_page('blacklist', ['word'], ['word'], after_id, limit, prefix, backward)
+
     def add_blacklist_word(self, word: str):
         """add blacklist word row to blacklist table"""
         self._insert('blacklist', {'word': word})
@@ -125,6 +229,107 @@ class DbController:
         """delete blacklist word row from blacklist table"""
         self._delete('blacklist', row_id)
 
+    def get_fingerprints(self, keys: List[str], created_after: int, prefixes: List[str] = ()) -> List[str]:
+        """get existing not expired fingerprints keys equal to keys or starting with prefixes ending by colon"""
+        placeholders = ", ".join("?" * len(keys))
+        conditions = [f"key in ({placeholders})"] + ["(key > ? and key < ?)"] * len(prefixes)
+        bounds = [bound for prefix in prefixes for bound in (prefix, prefix[:-1] + ';')]
+        self._cursor.execute(f"SELECT key from fingerprints where created_at > ? and ({' or '.join(conditions)})",
+                             (created_after, *keys, *bounds))
+        return [row[0] for row in self._cursor.fetchall()]
+
+    def add_fingerprints(self, keys: List[str], created_at: int):
+        """add or refresh fingerprints keys"""
+        with self._connection:
+            self._cursor.executemany("INSERT OR REPLACE INTO fingerprints (key, created_at) VALUES (?, ?)",
+                                     [(key, created_at) for key in keys])
+
+    def delete_fingerprints(self, created_before: int):
+        """delete expired fingerprints"""
+        with self._connection:
+            self._cursor.execute("DELETE from fingerprints where created_at < ?", (created_before,))
+
+    def heartbeat_worker(self, worker_id: str, heartbeat_at: float, stats: Dict):
+        """add or refresh shard worker row with its stats"""
+        columns = ('sources', 'channels', 'sent', 'failed', 'lag')
+        with self._connection:
+            self._cursor.execute(f"INSERT OR REPLACE INTO workers (id, heartbeat_at, {', '.join(columns)}) "
+                                 f"VALUES (?, ?, {', '.join('?' * len(columns))})",
+                                 (worker_id, heartbeat_at, *(stats.get(column, 0) for column in columns)))
+
+    def delete_worker(self, worker_id: str):
+        """delete shard worker and release its leases and vk tokens"""
+        with self._connection:
+            self._cursor.execute("DELETE from leases where worker_id = ?", (worker_id,))
+            self._cursor.execute("DELETE from worker_tokens where worker_id = ?", (worker_id,))
+            self._cursor.execute("DELETE from workers where id = ?", (worker_id,))
+
+    def claim_worker_tokens(self, worker_id: str, tokens: List[str], alive_after: float) -> List[str]:
+        """claim vk tokens hashes which are free or held by dead workers, get ones held by other live workers"""
+        with self._connection:
+            self._cursor.executemany(
+                "INSERT INTO worker_tokens (token, worker_id) VALUES (?, ?) "
+                "ON CONFLICT(token) DO UPDATE SET worker_id = excluded.worker_id "
+                "WHERE worker_tokens.worker_id NOT IN (SELECT id from workers where heartbeat_at >= ?)",
+                [(token, worker_id, alive_after) for token in tokens])
+        placeholders = ", ".join("?" * len(tokens))
+        self._cursor.execute(f"SELECT token from worker_tokens where worker_id != ? AND token in ({placeholders})",
+                             (worker_id, *tokens))
+        return [row[0] for row in self._cursor.fetchall()]
+
+    def get_flag(self, name: str) -> int:
+        """get value of shared flag, missing flag is 0"""
+        self._cursor.execute("SELECT value from flags where name = ?", (name,))
+        row = self._cursor.fetchone()
+        return row[0] if row else 0
+
+    def set_flag(self, name: str, value: int):
+        """set value of shared flag"""
+        with self._connection:
+            self._cursor.execute("INSERT OR REPLACE INTO flags (name, value) VALUES (?, ?)", (name, value))
+
+    def get_workers(self, alive_after: float) -> List[Dict]:
+        """get shard workers with heartbeat after time"""
+        self._cursor.execute("SELECT * from workers where heartbeat_at >= ? ORDER BY id", (alive_after,))
+        return self._rows_to_dict(self._cursor.fetchall(), self._get_columns())
+
+    def count_sources(self) -> int:
+        """count vk sources of active channels"""
+        self._cursor.execute("SELECT count(DISTINCT vk_channel) from channels where is_active")
+        return self._cursor.fetchone()[0]
+
+    def renew_leases(self, worker_id: str, now: float, expires_at: float) -> List[str]:
+        """drop worker leases of sources without active channels, extend other not expired ones and get their sources"""
+        with self._connection:
+            self._cursor.execute("DELETE from leases where worker_id = ? AND source NOT IN "
+                                 "(SELECT vk_channel from channels where is_active)", (worker_id,))
+            self._cursor.execute("UPDATE leases SET expires_at = ? where worker_id = ? AND expires_at >= ?",
+                                 (expires_at, worker_id, now))
+        self._cursor.execute("SELECT source from leases where worker_id = ? AND expires_at >= ? ORDER BY source",
+                             (worker_id, now))
+        return [row[0] for row in self._cursor.fetchall()]
+
+    def claim_leases(self, worker_id: str, now: float, expires_at: float, limit: int):
+        """lease up to limit sources of active channels which are free or expired"""
+        with self._connection:
+            self._cursor.execute(
+                "INSERT INTO leases (source, worker_id, expires_at) "
+                "SELECT DISTINCT vk_channel, ?, ? from channels where is_active AND vk_channel NOT IN "
+                "(SELECT source from leases where expires_at >= ?) ORDER BY vk_channel LIMIT ? "
+                "ON CONFLICT(source) DO UPDATE SET worker_id = excluded.worker_id, expires_at = excluded.expires_at "
+                "WHERE leases.expires_at < ?", (worker_id, expires_at, now, limit, now))
+
+    def release_leases(self, worker_id: str, sources: List[str]):
+        """release worker leases of sources"""
+        with self._connection:
+            self._cursor.executemany("DELETE from leases where worker_id = ? AND source = ?",
+                                     [(worker_id, source) for source in sources])
+
+    def get_leased_channels(self, worker_id: str, now: float) -> List[Channel]:
+        """get active channels of sources leased by worker"""
+        return self._select_channels("where leases.worker_id = ? AND leases.expires_at >= ? AND channels.is_active",
+                                     (worker_id, now), "JOIN leases ON leases.source = channels.vk_channel")
+
     def clear_db(self):
         """clear existing db"""
         self._cursor.execute("SELECT name FROM 'sqlite_master' WHERE type='table'")
@@ -153,3 +358,134 @@ class DbController:
             with open(dump_file_path, 'r', encoding='UTF-8') as f:
                 dump_file = f.read()
                 self._cursor.executescript(dump_file)
+            self._migrate_db()
+            self._channel_columns = self._get_channel_columns()
+
+    def close(self):
+        """close db connection"""
+        self._connection.close()
+
+
+class AsyncDbController:
+    """awaitable db facade, writes run in dedicated writer thread and reads in pool with connection per thread"""
+    reader_methods = ('get_all_channels', 'get_channel', 'get_channel_by_tg_vk_channel_key', 'get_blacklist_words',
+                      'get_fingerprints', 'create_db_dump', 'get_channels_page', 'count_channels',
+                      'get_blacklist_page', 'get_workers', 'count_sources',
+                      'get_leased_channels', 'get_flag')
+
+    def __init__(self, path: str = DB_PATH, readers: int = DB_READERS):
+        self._local = threading.local()
+        self._connections = []
+        self._writer = ThreadPoolExecutor(1, 'db-writer', initializer=self._connect, initargs=(path, False))
+        self._writer.submit(lambda: None).result()
+        self._readers = ThreadPoolExecutor(readers, 'db-reader', initializer=self._connect, initargs=(path, True))
+
+    def _connect(self, path: str, read_only: bool):
+        """open connection for current executor thread"""
+        self._local.db = DbController(path, read_only)
+        self._connections.append(self._local.db)
+
+    def _call(self, method: str, *args, **kwargs):
+        """call db method with current thread connection"""
+        return getattr(self._local.db, method)(*args, **kwargs)
+
+    async def _run(self, method: str, *args, **kwargs):
+        """run db method in reader or writer thread"""
+        executor = self._readers if method in self.reader_methods else self._writer
+        return await asyncio.get_running_loop().run_in_executor(executor, partial(self._call, method, *args, **kwargs))
+
+    async def get_all_channels(self) -> List[Channel]:
+        return await self._run('get_all_channels')
+
+    async def get_channel(self, row_id: int) -> List[Channel]:
+        return await self._run('get_channel', row_id)
+
+    async def get_channel_by_tg_vk_channel_key(self, telegram_channel: str, vk_channel: str) -> List[Channel]:
+        return await self._run('get_channel_by_tg_vk_channel_key', telegram_channel, vk_channel)
+
+    async def get_channels_page(self, after_id: int = 0, limit: int = 5, prefix: str = '',
+                                backward: bool = False) -> List[Dict]:
+        return await self._run('get_channels_page', after_id, limit, prefix, backward)
+
+    async def count_channels(self, prefix: str = '') -> int:
+        return await self._run('count_channels', prefix)
+
+    async def add_channel(self, channel_data: Dict):
+        await self._run('add_channel', channel_data)
+
+    async def delete_channel(self, row_id: int):
+        await self._run('delete_channel', row_id)
+
+    async def update_channel(self, row_id: int, channel_data: Dict):
+        await self._run('update_channel', row_id, dict(channel_data))
+
+    async def update_channels_fields(self, channels_fields: Dict[int, Dict]):
+        await self._run('update_channels_fields', channels_fields)
+
+    async def get_blacklist_words(self, get_id=False) -> List:
+        return await self._run('get_blacklist_words', get_id)
+
+    async def get_blacklist_page(self, after_id: int = 0, limit: int = 5, prefix: str = '',
+                                 backward: bool = False) -> List[Dict]:
+        return await self._run('get_blacklist_page', after_id, limit, prefix, backward)
+
+    async def add_blacklist_word(self, word: str):
+        await self._run('add_blacklist_word', word)
+
+    async def delete_blacklist_word(self, row_id: int):
+        await self._run('delete_blacklist_word', row_id)
+
+    async def get_fingerprints(self, keys: List[str], created_after: int, prefixes: List[str] = ()) -> List[str]:
+        return await self._run('get_fingerprints', keys, created_after, prefixes)
+
+    async def add_fingerprints(self, keys: List[str], created_at: int):
+        await self._run('add_fingerprints', keys, created_at)
+
+    async def delete_fingerprints(self, created_before: int):
+        await self._run('delete_fingerprints', created_before)
+
+    async def heartbeat_worker(self, worker_id: str, heartbeat_at: float, stats: Dict):
+        await self._run('heartbeat_worker', worker_id, heartbeat_at, stats)
+
+    async def delete_worker(self, worker_id: str):
+        await self._run('delete_worker', worker_id)
+
+    async def claim_worker_tokens(self, worker_id: str, tokens: List[str], alive_after: float) -> List[str]:
+        return await self._run('claim_worker_tokens', worker_id, tokens, alive_after)
+
+    async def get_flag(self, name: str) -> int:
+        return await self._run('get_flag', name)
+
+    async def set_flag(self, name: str, value: int):
+        await self._run('set_flag', name, value)
+
+    async def get_workers(self, alive_after: float) -> List[Dict]:
+        return await self._run('get_workers', alive_after)
+
+    async def count_sources(self) -> int:
+        return await self._run('count_sources')
+
+    async def renew_leases(self, worker_id: str, now: float, expires_at: float) -> List[str]:
+        return await self._run('renew_leases', worker_id, now, expires_at)
+
+    async def claim_leases(self, worker_id: str, now: float, expires_at: float, limit: int):
+        await self._run('claim_leases', worker_id, now, expires_at, limit)
+
+    async def release_leases(self, worker_id: str, sources: List[str]):
+        await self._run('release_leases', worker_id, sources)
+
+    async def get_leased_channels(self, worker_id: str, now: float) -> List[Channel]:
+        return await self._run('get_leased_channels', worker_id, now)
+
+    async def create_db_dump(self) -> str:
+        return await self._run('create_db_dump')
+
+    async def load_db_dump(self):
+        await self._run('load_db_dump')
+
+    def close(self):
+        """stop db threads and close connections"""
+        self._readers.shutdown()
+        self._writer.shutdown()
+        [connection.close() for connection in self._connections]
+        self._connections.clear()
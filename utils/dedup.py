@@ -0,0 +1,99 @@
+import hashlib
+import re
+import time
+from typing import Dict
+from typing import List
+from urllib.parse import urlsplit
+
+from utils.cache import TTLCache
+
+URL_PATTERN = re.compile(r'https?://\S+|\[[^|\]]*\||\]')
+WORD_PATTERN = re.compile(r'\w+')
+# simhash is split into bands, texts within SIMHASH_DISTANCE differing bits have at least one equal band
+SIMHASH_BANDS = 4
+SIMHASH_DISTANCE = SIMHASH_BANDS - 1
+
+
+def get_text_simhash(text: str, shingle_size: int = 3, min_words: int = 5) -> int:
+    """get 64 bit simhash of normalized text word shingles, short texts are not hashed"""
+    words = WORD_PATTERN.findall(URL_PATTERN.sub(' ', text.lower()))
+    if len(words) < min_words:
+        return 0
+    weights = [0] * 64
+    for index in range(len(words) - shingle_size + 1):
+        shingle = ' '.join(words[index:index + shingle_size]).encode('utf-8')
+        shingle_hash = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'big')
+        for bit in range(64):
+            weights[bit] += 1 if shingle_hash >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def get_simhash_band_prefixes(text_hash: int) -> List[str]:
+    """get fingerprint key prefixes of simhash bands, full simhash follows prefix in stored key"""
+    width = 64 // SIMHASH_BANDS
+    mask = (1 << width) - 1
+    return [f'band{index}:{text_hash >> index * width & mask:0{width // 4}x}:' for index in range(SIMHASH_BANDS)]
+
+
+def get_text_hashes(fingerprints: List[str]) -> List[int]:
+    """get text simhashes from post fingerprints"""
+    return [int(fingerprint[5:], 16) for fingerprint in fingerprints if fingerprint.startswith('text:')]
+
+
+def get_post_fingerprints(post: Dict) -> List[str]:
+    """get keys identifying post content: text simhash, photo urls, video ids and original post id"""
+    fingerprints = []
+    for item in [post] + post.get('copy_history', []):
+        if item is not post:
+            fingerprints.append(f"post:{item['owner_id']}_{item['id']}")
+        text_hash = get_text_simhash(item.get('text') or '')
+        if text_hash:
+            fingerprints.append(f'text:{text_hash:016x}')
+        for attachment in item.get('attachments', []):
+            if attachment.get('type') == 'photo' and attachment['photo'].get('sizes'):
+                fingerprints.append(f"photo:{urlsplit(attachment['photo']['sizes'][-1]['url']).path}")
+            elif attachment.get('type') == 'video':
+                fingerprints.append(f"video:{attachment['video']['owner_id']}_{attachment['video']['id']}")
+    fingerprints.append(f"post:{post['owner_id']}_{post['id']}")
+    return fingerprints
+
+
+class ContentIndex:
+    """remember content sent to telegram channels to skip duplicates from other vk sources"""
+    cleanup_interval = 60 * 60
+
+    def __init__(self, db, ttl: int = 7 * 24 * 60 * 60, cache_size: int = 100000):
+        self._db = db
+        self.ttl = ttl
+        self._cache = TTLCache(cache_size, ttl)
+        self._cleaned_at = 0
+
+    async def is_duplicate(self, scope: str, fingerprints: List[str]) -> bool:
+        """check if any fingerprint was already sent to scope or text is near duplicate of sent one"""
+        keys = [f'{scope}:{fingerprint}' for fingerprint in fingerprints]
+        if any(self._cache.get(key) for key in keys):
+            return True
+        text_hashes = get_text_hashes(fingerprints)
+        prefixes = [f'{scope}:{prefix}' for text_hash in text_hashes for prefix in get_simhash_band_prefixes(text_hash)]
+        found_keys = await self._db.get_fingerprints(keys, int(time.time()) - self.ttl, prefixes)
+        exact_keys = set(keys).intersection(found_keys)
+        for key in exact_keys:
+            self._cache.set(key, True)
+        if exact_keys:
+            return True
+        sent_hashes = {int(key.rsplit(':', 1)[1], 16) for key in found_keys}
+        return any((text_hash ^ sent_hash).bit_count() <= SIMHASH_DISTANCE
+                   for text_hash in text_hashes for sent_hash in sent_hashes)
+
+    async def add(self, scope: str, fingerprints: List[str]):
+        """remember fingerprints and text simhash bands sent to scope"""
+        keys = [f'{scope}:{fingerprint}' for fingerprint in fingerprints]
+        keys += [f'{scope}:{prefix}{text_hash:016x}' for text_hash in get_text_hashes(fingerprints)
+                 for prefix in get_simhash_band_prefixes(text_hash)]
+        for key in keys:
+            self._cache.set(key, True)
+        now = int(time.time())
+        await self._db.add_fingerprints(keys, now)
+        if now - self._cleaned_at > self.cleanup_interval:
+            await self._db.delete_fingerprints(now - self.ttl)
+            self._cleaned_at = now
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+MESSAGE_LIMIT = 4096
+
+
+class DigestBucket:
+    """failures with same category and error code"""
+    __slots__ = ('message', 'count', 'channels')
+
+    def __init__(self, message: str):
+        self.message = message
+        self.count = 0
+        self.channels: Dict[str, int] = {}
+
+
+class ErrorDigest:
+    """collect failures by error code and channel and send them to admin as one message per interval
+
+    first failure starts the window, later ones are only counted, so outage of many channels costs one message
+    """
+    def __init__(self, send: Callable[[str], Awaitable], interval: float = 300, sample_size: int = 5, logger=None):
+        self._send = send
+        self.interval = interval
+        self.sample_size = sample_size
+        self._logger = logger
+        self._buckets: Dict[Tuple[str, str], DigestBucket] = {}
+        self._started_at = 0.0
+        self._pending = None
+        self._task = None
+
+        self.failures = 0
+        self.sent = 0
+
+    def add(self, category: str, code, message: str, channel: str):
+        """count failure of channel"""
+        if not self._buckets:
+            self._started_at = time.time()
+        bucket = self._buckets.get((category, str(code)))
+        if bucket is None:
+            bucket = self._buckets[(category, str(code))] = DigestBucket(message)
+        bucket.count += 1
+        bucket.channels[channel] = bucket.channels.get(channel, 0) + 1
+        self.failures += 1
+        if self._pending:
+            self._pending.set()
+
+    def render(self) -> str:
+        """format collected failures, most frequent first"""
+        minutes = max(round((time.time() - self._started_at) / 60), 1)
+        lines = [f'⚠ Errors for last {minutes} min:']
+        buckets = sorted(self._buckets.items(), key=lambda item: item[1].count, reverse=True)
+        for (category, code), bucket in buckets:
+            channels = sorted(bucket.channels, key=bucket.channels.get, reverse=True)
+            sample = ', '.join(channels[:self.sample_size])
+            if len(channels) > self.sample_size:
+                sample += f' and {len(channels) - self.sample_size} more'
+            lines.append(f'{category} {code}: {bucket.message} - {bucket.count} times, '
+                         f'{len(channels)} channels: {sample}')
+        return self._truncate(lines)
+
+    @staticmethod
+    def _truncate(lines: List[str]) -> str:
+        """keep whole lines fitting telegram message limit"""
+        message = lines[0]
+        for index, line in enumerate(lines[1:], 1):
+            tail = f'\n... {len(lines) - index} more errors'
+            if len(message) + len(line) + 1 + len(tail) > MESSAGE_LIMIT:
+                return message + tail
+            message += f'\n{line}'
+        return message
+
+    async def flush(self):
+        """send digest of collected failures"""
+        if self._pending:
+            self._pending.clear()
+        if not self._buckets:
+            return
+        message = self.render()
+        self._buckets = {}
+        try:
+            await self._send(message)
+            self.sent += 1
+        except Exception as error:
+            if self._logger:
+                self._logger.error(f'While sending errors digest: {error}')
+
+    async def _run(self):
+        """send digest one interval after first failure"""
+        while True:
+            await self._pending.wait()
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def start(self):
+        """start sending digests"""
+        if not self._task:
+            self._pending = asyncio.Event()
+            if self._buckets:
+                self._pending.set()
+            self._task = asyncio.get_running_loop().create_task(self._run(), name='errors-digest')
+
+    async def stop(self):
+        """stop sending digests and send remaining failures"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
@@ -0,0 +1,112 @@
+import random
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from utils.models import Channel
+
+
+class HealthState:
+    """vk source circuit breaker states"""
+    closed = 'closed'
+    open = 'open'
+    half_open = 'half_open'
+    disabled = 'disabled'
+
+
+class ErrorKind:
+    """vk error classes"""
+    transient = 'transient'
+    throttled = 'throttled'
+    permanent = 'permanent'
+
+
+# access denied, deleted or banned, blocked content, private profile, invalid domain or owner id
+PERMANENT_ERRORS = {15, 18, 19, 30, 100, 113}
+# no available tokens, too many requests, flood control, daily quota reached
+THROTTLED_ERRORS = {-1, 6, 9, 29}
+
+HEALTHY_FIELDS = {'health_state': HealthState.closed, 'health_failures': 0, 'health_retry_at': 0.0, 'last_error': ''}
+
+
+def classify_error(error_code) -> str:
+    """get kind of vk error, network errors and unknown codes are transient"""
+    if error_code in PERMANENT_ERRORS:
+        return ErrorKind.permanent
+    if error_code in THROTTLED_ERRORS:
+        return ErrorKind.throttled
+    return ErrorKind.transient
+
+
+class SourceHealth:
+    """circuit breaker of one vk source
+
+    closed source is checked by its interval, after threshold failures in a row it opens and next check is
+    delayed by exponential backoff with jitter, then one half-open check closes it or opens it for longer,
+    throttled errors open it at once because retrying soon cannot help
+    """
+    def __init__(self, threshold: int = 3, max_backoff: float = 24 * 60 * 60, jitter: float = 0.2,
+                 state: str = HealthState.closed, failures: int = 0, retry_at: float = 0, last_error: str = ''):
+        self.threshold = max(threshold, 1)
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.state = state or HealthState.closed
+        self.failures = failures or 0
+        self.retry_at = retry_at or 0.0
+        self.last_error = last_error or ''
+
+    @classmethod
+    def from_channels(cls, channels: List[Channel], **options) -> 'SourceHealth':
+        """restore breaker from persisted fields of source channels, least healthy channel wins"""
+        channel_data = max(channels, key=lambda channel: (channel.health_failures or 0, channel.health_retry_at or 0))
+        return cls(state=channel_data.health_state, failures=channel_data.health_failures,
+                   retry_at=channel_data.health_retry_at, last_error=channel_data.last_error, **options)
+
+    @property
+    def fields(self) -> Dict:
+        """channel fields to persist"""
+        return {'health_state': self.state, 'health_failures': self.failures, 'health_retry_at': self.retry_at,
+                'last_error': self.last_error}
+
+    def get_delay(self, now: Optional[float] = None) -> float:
+        """get seconds until open source may be checked"""
+        if self.state != HealthState.open:
+            return 0
+        return max(self.retry_at - (time.time() if now is None else now), 0)
+
+    def get_backoff(self, interval: float) -> float:
+        """get interval doubled for every failure over threshold, capped and spread by jitter"""
+        exponent = max(self.failures - self.threshold, 0)
+        backoff = min(interval * 2 ** min(exponent, 32), self.max_backoff)
+        return backoff * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def begin_check(self, now: Optional[float] = None):
+        """move open source to half-open when its retry time came"""
+        if self.state == HealthState.open and self.get_delay(now) <= 0:
+            self.state = HealthState.half_open
+
+    def record_success(self) -> bool:
+        """close breaker, return True when source recovered"""
+        recovered = self.state != HealthState.closed
+        self.state, self.failures, self.retry_at, self.last_error = HealthState.closed, 0, 0.0, ''
+        return recovered
+
+    def record_failure(self, kind: str, error: str, interval: float, now: Optional[float] = None) -> float:
+        """count failure and return delay until next check"""
+        now = time.time() if now is None else now
+        self.failures += 1
+        self.last_error = error[:255]
+        if kind == ErrorKind.throttled:
+            self.failures = max(self.failures, self.threshold)
+        if self.state == HealthState.closed and self.failures < self.threshold:
+            return interval
+        delay = self.get_backoff(interval)
+        self.state = HealthState.open
+        self.retry_at = now + delay
+        return delay
+
+    def disable(self, error: str):
+        """stop checking source after permanent error"""
+        self.failures += 1
+        self.state, self.retry_at, self.last_error = HealthState.disabled, 0.0, error[:255]
@@ -0,0 +1,252 @@
+import bisect
+import math
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from aiohttp import web
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 2 * 3600, 6 * 3600, 24 * 3600)
+
+
+def _escape_label(value) -> str:
+    """escape label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    """format prometheus labels block"""
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return f"{{{','.join(pairs)}}}" if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    """format sample value"""
+    if value == math.inf:
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """base metric with label sets"""
+    type = 'untyped'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """get (name suffix, labels, value) samples"""
+        return []
+
+    def render(self) -> List[str]:
+        """render metric in prometheus text format"""
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.type}']
+        lines.extend(f'{self.name}{suffix}{labels} {_format_value(value)}' for suffix, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    """monotonic counter"""
+    type = 'counter'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values, value: float = 1):
+        """increase counter of label set"""
+        self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def get(self, *label_values) -> float:
+        """get counter value, without labels all label sets are summed"""
+        if not label_values and self.labels:
+            return sum(self.values.values())
+        return self.values.get(label_values, 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [('', _format_labels(self.labels, label_values), value)
+                for label_values, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    """current value, set directly or read from callback on render"""
+    type = 'gauge'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, description, labels)
+        self.callback = callback
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *label_values):
+        """set gauge value of label set"""
+        self.values[label_values] = value
+
+    def remove(self, *label_values):
+        """drop label set"""
+        self.values.pop(label_values, None)
+
+    def get(self, *label_values) -> float:
+        """get gauge value"""
+        if self.callback:
+            return self.callback()
+        return self.values.get(label_values, 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        if self.callback:
+            return [('', '', self.callback())]
+        return [('', _format_labels(self.labels, label_values), value)
+                for label_values, value in sorted(self.values.items())]
+
+
+class Histogram(Metric):
+    """cumulative buckets histogram with sum and count"""
+    type = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *label_values):
+        """add observation to label set"""
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def _merge(self, *label_values) -> Tuple[List[int], float, int]:
+        """get series of label set, without labels all label sets are merged"""
+        if label_values or not self.labels:
+            series = self.values.get(label_values)
+            return (list(series[0]), series[1], series[2]) if series else ([0] * len(self.buckets), 0.0, 0)
+        counts, total, count = [0] * len(self.buckets), 0.0, 0
+        for series_counts, series_total, series_count in self.values.values():
+            counts = [a + b for a, b in zip(counts, series_counts)]
+            total += series_total
+            count += series_count
+        return counts, total, count
+
+    def count(self, *label_values) -> int:
+        """get number of observations"""
+        return self._merge(*label_values)[2]
+
+    def mean(self, *label_values) -> float:
+        """get average observation"""
+        _, total, count = self._merge(*label_values)
+        return total / count if count else 0.0
+
+    def quantile(self, q: float, *label_values) -> float:
+        """estimate quantile by linear interpolation inside bucket"""
+        counts, _, count = self._merge(*label_values)
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                if upper == math.inf:
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-2]
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        for label_values, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bucket)}"'
+                samples.append(('_bucket', _format_labels(self.labels, label_values, le), cumulative))
+            samples.append(('_sum', _format_labels(self.labels, label_values), total))
+            samples.append(('_count', _format_labels(self.labels, label_values), count))
+        return samples
+
+
+class MetricsRegistry:
+    """named metrics rendered together"""
+    def __init__(self, prefix: str = 'vkposter'):
+        self.prefix = prefix
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        """add metric or get already registered one with same name"""
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, description: str, labels: Sequence[str] = ()) -> Counter:
+        """get or create counter"""
+        return self._register(Counter(f'{self.prefix}_{name}', description, labels))
+
+    def gauge(self, name: str, description: str, labels: Sequence[str] = (),
+              callback: Optional[Callable[[], float]] = None) -> Gauge:
+        """get or create gauge"""
+        gauge = self._register(Gauge(f'{self.prefix}_{name}', description, labels))
+        if callback:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name: str, description: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        """get or create histogram"""
+        return self._register(Histogram(f'{self.prefix}_{name}', description, labels, buckets))
+
+    def get(self, name: str) -> Optional[Metric]:
+        """get metric by name without prefix"""
+        return self._metrics.get(f'{self.prefix}_{name}')
+
+    def render(self) -> str:
+        """render all metrics in prometheus text format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """embedded http server exposing metrics for prometheus"""
+    def __init__(self, registry: MetricsRegistry, port: int = 0, host: str = '0.0.0.0', logger=None):
+        self.registry = registry
+        self.port = port
+        self.host = host
+        self._logger = logger
+        self._runner = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        """serve metrics page"""
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def start(self):
+        """start http server, zero port disables it"""
+        if not self.port or self._runner:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        if self._logger:
+            self._logger.info(f'Metrics are served on {self.host}:{self.port}/metrics')
+
+    async def stop(self):
+        """stop http server"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+from dataclasses import fields
+from typing import Dict
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+
+@dataclass(slots=True)
+class Channel:
+    """channels table row, fields follow columns order of select by CHANNEL_COLUMNS"""
+    id: int
+    is_active: bool = False
+    telegram_channel: str = ''
+    vk_channel: str = ''
+    vk_channel_id: int = 0
+    last_post_id: int = 0
+    send_video_post: bool = False
+    send_video_post_text: bool = False
+    send_photo_post: bool = False
+    send_photo_post_text: bool = False
+    send_text_post: bool = False
+    set_last_post_id: bool = True
+    timer: int = 60
+    enable_filters: bool = True
+    adaptive_timer: bool = False
+    post_interval: float = 0
+    last_post_date: int = 0
+    revision: int = 0
+    health_state: str = 'closed'
+    health_failures: int = 0
+    health_retry_at: float = 0
+    last_error: str = ''
+    next_due: int = 0
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Tuple]) -> List['Channel']:
+        """build channels from rows selected by CHANNEL_COLUMNS"""
+        return [cls(*row) for row in rows]
+
+    def to_dict(self) -> Dict:
+        """get channel fields as dict"""
+        return {column: getattr(self, column) for column in CHANNEL_COLUMNS}
+
+
+CHANNEL_COLUMNS = tuple(field.name for field in fields(Channel))
+
+
+@dataclass(slots=True)
+class Link:
+    """Contains parsed link or external video"""
+    title: str
+    url: str
+
+
+@dataclass(slots=True)
+class Video:
+    """Contains parsed vk video"""
+    id: str
+    title: str
+    url: str
+    platform: str
+
+
+@dataclass(slots=True)
+class Attachments:
+    """Contains parsed post attachments by type"""
+    photo: Tuple[str, ...] = ()
+    video: Tuple[str, ...] = ()
+    link: Tuple[Link, ...] = ()
+
+
+@dataclass(slots=True)
+class Post:
+    """Contains parsed vk post"""
+    id: int
+    owner_id: int
+    date: int
+    text: str
+    attachments: Attachments
+    fingerprints: List[str]
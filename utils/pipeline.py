@@ -0,0 +1,75 @@
+import asyncio
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Hashable
+
+
+class PartitionedStage:
+    """pipeline stage with worker per bounded queue
+
+    items with same key go to same worker and are handled in order, put waits while worker queue is full,
+    so slow stage holds back the stage feeding it
+    """
+    def __init__(self, handler: Callable[[Any], Awaitable], workers: int = 4, queue_size: int = 100, logger=None,
+                 name: str = 'stage'):
+        self._handler = handler
+        self._logger = logger
+        self.name = name
+        self._queues = [asyncio.Queue(queue_size) for _ in range(max(workers, 1))]
+        self._tasks = []
+
+        self.busy_workers = 0
+        self.handled = 0
+        self.failed = 0
+
+    @property
+    def depth(self) -> int:
+        """number of items waiting for workers"""
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def put(self, key: Hashable, item: Any):
+        """add item to queue of key worker, waits for free place"""
+        await self._queues[hash(key) % len(self._queues)].put(item)
+
+    async def _work(self, queue: asyncio.Queue):
+        """handle items of one queue"""
+        while True:
+            item = await queue.get()
+            self.busy_workers += 1
+            try:
+                await self._handler(item)
+                self.handled += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self.failed += 1
+                if self._logger:
+                    self._logger.error(f'In {self.name} stage: {error}')
+            finally:
+                self.busy_workers -= 1
+                queue.task_done()
+
+    async def start(self):
+        """start workers"""
+        if self._tasks:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._work(queue), name=f'{self.name}-worker-{number}')
+                       for number, queue in enumerate(self._queues)]
+
+    async def stop(self, timeout: float = 0):
+        """wait up to timeout for queued items and stop workers, not handled items are dropped"""
+        if self._tasks and timeout:
+            try:
+                await asyncio.wait_for(asyncio.gather(*[queue.join() for queue in self._queues]), timeout)
+            except asyncio.TimeoutError:
+                pass
+        [task.cancel() for task in self._tasks]
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.busy_workers = 0
+        for queue in self._queues:
+            while not queue.empty():
+                queue.get_nowait()
+                queue.task_done()
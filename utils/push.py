@@ -0,0 +1,154 @@
+import asyncio
+import hmac
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+
+import aiohttp
+from aiohttp import web
+
+from utils.api import ApiUrls
+
+PostHandler = Callable[[int, Dict], Awaitable]
+
+
+def parse_group_values(value: str) -> Dict[int, str]:
+    """parse 'group_id:value,group_id:value' setting"""
+    groups = {}
+    for item in value.split(','):
+        group_id, _, group_value = item.strip().partition(':')
+        if group_id.strip().lstrip('-').isdigit() and group_value:
+            groups[abs(int(group_id))] = group_value.strip()
+    return groups
+
+
+class CallbackReceiver:
+    """embedded vk callback api server, new wall posts of owned groups are passed to handler"""
+    def __init__(self, handler: PostHandler, confirmations: Dict[int, str], secret: str = '', port: int = 0,
+                 host: str = '0.0.0.0', path: str = '/vk/callback', logger=None):
+        self._handler = handler
+        self.confirmations = confirmations
+        self.secret = secret
+        self.port = port
+        self.host = host
+        self.path = path
+        self._logger = logger
+        self._runner = None
+        self._tasks = set()
+
+        self.events = 0
+
+    @property
+    def group_ids(self):
+        """groups with confirmation code"""
+        return set(self.confirmations)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        """answer confirmation request or accept event"""
+        try:
+            event = await request.json()
+        except ValueError:
+            return web.Response(status=400, text='bad request')
+        group_id = event.get('group_id')
+        if self.secret and not hmac.compare_digest(str(event.get('secret', '')), self.secret):
+            if self._logger:
+                self._logger.warning(f'Callback event with wrong secret from group {group_id}')
+            return web.Response(status=403, text='forbidden')
+        if event.get('type') == 'confirmation':
+            confirmation = self.confirmations.get(group_id)
+            if confirmation is None:
+                return web.Response(status=404, text='unknown group')
+            return web.Response(text=confirmation)
+        if event.get('type') == 'wall_post_new' and group_id in self.confirmations:
+            self.events += 1
+            task = asyncio.get_running_loop().create_task(self._handler(group_id, event.get('object') or {}))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return web.Response(text='ok')
+
+    async def start(self):
+        """start http server, zero port disables it"""
+        if not self.port or not self.confirmations or self._runner:
+            return
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        if self._logger:
+            self._logger.info(f'VK callback api is served on {self.host}:{self.port}{self.path}')
+
+    async def stop(self):
+        """stop http server and wait for running handlers"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class LongPollClient:
+    """vk bots long poll client for one group, group token must have wall_post_new event enabled"""
+    def __init__(self, api, group_id: int, access_token: str, handler: PostHandler, wait: int = 25, logger=None):
+        self._api = api
+        self.group_id = group_id
+        self._access_token = access_token
+        self._handler = handler
+        self.wait = wait
+        self._logger = logger
+        self._server = None
+        self._task = None
+
+        self.events = 0
+
+    async def _get_server(self):
+        """request long poll server, key and ts"""
+        response = await self._api._fetch(ApiUrls.long_poll_server,
+                                          {'group_id': self.group_id, 'access_token': self._access_token})
+        if 'error' in response:
+            raise RuntimeError(response['error'].get('error_msg'))
+        self._server = response['response']
+
+    async def _check(self) -> Dict:
+        """wait for events"""
+        params = {'act': 'a_check', 'key': self._server['key'], 'ts': self._server['ts'], 'wait': self.wait}
+        async with self._api._session.get(self._server['server'], params=params,
+                                          timeout=aiohttp.ClientTimeout(total=self.wait + 10)) as response:
+            return await response.json(content_type=None)
+
+    async def _poll(self):
+        """receive events until cancelled, server is requested again when key expires"""
+        while True:
+            try:
+                if not self._server:
+                    await self._get_server()
+                response = await self._check()
+                if response.get('failed') == 1:
+                    self._server['ts'] = response['ts']
+                    continue
+                if response.get('failed'):
+                    self._server = None
+                    continue
+                self._server['ts'] = response['ts']
+                for update in response.get('updates', []):
+                    if update.get('type') == 'wall_post_new':
+                        self.events += 1
+                        await self._handler(self.group_id, update.get('object') or {})
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                if self._logger:
+                    self._logger.error(f'While long polling group {self.group_id}: {error}')
+                self._server = None
+                await asyncio.sleep(self.wait)
+
+    async def start(self):
+        """start long polling"""
+        if not self._task:
+            self._task = asyncio.get_running_loop().create_task(self._poll(), name=f'long-poll-{self.group_id}')
+
+    async def stop(self):
+        """stop long polling"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable
+
+EPSILON = 1e-9
+
+
+class TokenBucket:
+    """async token bucket shared by all api callers, waiters are served in FIFO order"""
+    def __init__(self, rate: float = 3, burst: int = 1, max_backoff: float = 30,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable = asyncio.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.max_backoff = max_backoff
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(burst)
+        self._updated_at = clock()
+        self._blocked_until = 0.0
+        self._backoff = 0.0
+        self._waiters = deque()
+        self._drainer = None
+
+        self.granted = 0
+        self.wait_time = 0.0
+
+    @property
+    def waiting(self) -> int:
+        """number of callers waiting for a token"""
+        return len(self._waiters)
+
+    @property
+    def available(self) -> float:
+        """tokens which can be granted now less waiting callers, blocked time counts as missing tokens"""
+        now = self._clock()
+        self._refill(now)
+        return self._tokens - len(self._waiters) - max(self._blocked_until - now, 0) * self.rate
+
+    def _refill(self, now: float):
+        """add tokens for time passed since last refill"""
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _get_delay(self, now: float) -> float:
+        """get seconds until next token can be granted"""
+        delay = max(self._blocked_until - now, 0)
+        if self._tokens < 1 - EPSILON:
+            delay = max(delay, (1 - self._tokens) / self.rate)
+        return delay if delay > EPSILON else 0
+
+    async def _drain(self):
+        """grant tokens to waiters one by one"""
+        while self._waiters:
+            waiter = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            now = self._clock()
+            self._refill(now)
+            delay = self._get_delay(now)
+            if delay > 0:
+                await self._sleep(delay)
+                continue
+            self._tokens = max(self._tokens - 1, 0)
+            self._waiters.popleft()
+            waiter.set_result(None)
+
+    async def acquire(self):
+        """wait for a free token"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if not self._drainer or self._drainer.done():
+            self._drainer = asyncio.get_running_loop().create_task(self._drain())
+        started_at = self._clock()
+        await waiter
+        self.granted += 1
+        self.wait_time += self._clock() - started_at
+
+    def penalize(self):
+        """stop granting tokens for a while after flood control error, backoff doubles on each call"""
+        self._backoff = min(self._backoff * 2, self.max_backoff) if self._backoff else 1.0
+        now = self._clock()
+        self._refill(now)
+        self._tokens = 0
+        self._blocked_until = now + self._backoff
+
+    def reset_backoff(self):
+        """reset backoff after successful request"""
+        self._backoff = 0.0
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
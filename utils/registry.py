@@ -0,0 +1,62 @@
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from utils.models import Channel
+
+
+class ChannelRegistry:
+    """in memory channels indexed by id and by (telegram_channel, vk_channel) key"""
+    def __init__(self):
+        self._by_id: Dict[int, Channel] = {}
+        self._by_key: Dict[Tuple[str, str], Channel] = {}
+        self._active_ids = set()
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self) -> Iterator[Channel]:
+        return iter(self._by_id.values())
+
+    def __contains__(self, channel_id: int) -> bool:
+        return channel_id in self._by_id
+
+    @property
+    def active_count(self) -> int:
+        """number of enabled channels"""
+        return len(self._active_ids)
+
+    def load(self, channels: List[Channel]):
+        """replace all channels"""
+        self._by_id.clear()
+        self._by_key.clear()
+        self._active_ids.clear()
+        [self.add(channel) for channel in channels]
+
+    def get(self, channel_id: int) -> Optional[Channel]:
+        """get channel by id"""
+        return self._by_id.get(channel_id)
+
+    def get_by_key(self, telegram_channel: str, vk_channel: str) -> Optional[Channel]:
+        """get channel by telegram and vk channels names"""
+        return self._by_key.get((telegram_channel, vk_channel))
+
+    def add(self, channel: Channel):
+        """add channel or replace existing one with same id"""
+        self.remove(channel.id)
+        self._by_id[channel.id] = channel
+        self._by_key[(channel.telegram_channel, channel.vk_channel)] = channel
+        if channel.is_active:
+            self._active_ids.add(channel.id)
+
+    def remove(self, channel_id: int) -> Optional[Channel]:
+        """remove channel by id"""
+        channel = self._by_id.pop(channel_id, None)
+        if channel:
+            key = (channel.telegram_channel, channel.vk_channel)
+            if self._by_key.get(key) is channel:
+                del self._by_key[key]
+            self._active_ids.discard(channel_id)
+        return channel
@@ -0,0 +1,141 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Awaitable
+from typing import Callable
+from typing import Hashable
+from typing import Optional
+
+
+class Scheduler:
+    """heap based scheduler which hands due jobs to bounded worker pool
+
+    handler gets job key and returns delay in seconds until next run or None to drop job
+    """
+    def __init__(self, handler: Callable[[Hashable], Awaitable[Optional[float]]], workers: int = 25,
+                 queue_size: int = 100, logger=None, clock: Callable[[], float] = time.monotonic):
+        self._handler = handler
+        self._workers_count = workers
+        self._queue_size = queue_size
+        self._logger = logger
+        self._clock = clock
+
+        self._heap = []
+        self._jobs = {}
+        self._counter = itertools.count()
+        self._queue = None
+        self._wakeup = None
+        self._tasks = []
+
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.busy_workers = 0
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._jobs
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def queue_depth(self) -> int:
+        """number of due jobs waiting for free worker"""
+        return self._queue.qsize() if self._queue else 0
+
+    def get_due_time(self, key: Hashable) -> Optional[float]:
+        """get next run time of job"""
+        entry = self._jobs.get(key)
+        return entry[0] if entry else None
+
+    def schedule(self, key: Hashable, delay: float = 0):
+        """add job or change its next run time"""
+        entry = [self._clock() + max(delay, 0), next(self._counter), key]
+        self._jobs[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._wakeup and self._heap[0] is entry:
+            self._wakeup.set()
+
+    def remove(self, key: Hashable):
+        """remove job, heap entry is dropped lazily"""
+        self._jobs.pop(key, None)
+
+    def clear(self):
+        """remove all jobs"""
+        self._jobs.clear()
+        self._heap.clear()
+
+    def _pop_due(self) -> Optional[list]:
+        """pop earliest valid entry if it is due"""
+        while self._heap and self._jobs.get(self._heap[0][2]) is not self._heap[0]:
+            heapq.heappop(self._heap)
+        if self._heap and self._heap[0][0] <= self._clock():
+            return heapq.heappop(self._heap)
+
+    def _get_sleep_time(self) -> Optional[float]:
+        """get seconds until earliest job"""
+        return max(self._heap[0][0] - self._clock(), 0) if self._heap else None
+
+    async def _dispatch(self):
+        """move due jobs to workers queue"""
+        while True:
+            entry = self._pop_due()
+            if entry:
+                lag = self._clock() - entry[0]
+                self.lag = lag
+                self.max_lag = max(self.max_lag, lag)
+                await self._queue.put(entry)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._get_sleep_time())
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self):
+        """run due jobs and schedule their next run"""
+        while True:
+            entry = await self._queue.get()
+            key = entry[2]
+            delay = None
+            self.busy_workers += 1
+            try:
+                if self._jobs.get(key) is entry:
+                    delay = await self._handler(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                if self._logger:
+                    self._logger.exception(f'Scheduled job {key} failed: {error}')
+            finally:
+                self.busy_workers -= 1
+                self._queue.task_done()
+            if self._jobs.get(key) is entry:
+                if delay is None:
+                    self.remove(key)
+                else:
+                    self.schedule(key, delay)
+
+    async def start(self):
+        """start dispatcher and workers"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(self._queue_size)
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._tasks.append(loop.create_task(self._dispatch(), name='scheduler-dispatcher'))
+        self._tasks.extend(loop.create_task(self._work(), name=f'scheduler-worker-{number}')
+                           for number in range(self._workers_count))
+
+    async def stop(self):
+        """stop dispatcher and workers"""
+        [task.cancel() for task in self._tasks]
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._queue = None
+        self._wakeup = None
+        self.busy_workers = 0
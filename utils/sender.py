@@ -0,0 +1,149 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Union
+
+from aiogram.utils.exceptions import RetryAfter
+
+from utils.rate_limiter import TokenBucket
+
+
+class SendJob:
+    """queued telegram delivery"""
+    __slots__ = ('send', 'retries')
+
+    def __init__(self, send: Callable[[], Awaitable]):
+        self.send = send
+        self.retries = 0
+
+
+class TelegramDispatcher:
+    """outbound telegram queue: jobs of one chat are sent in order, chats are served by bounded worker pool"""
+    def __init__(self, workers: int = 4, global_rate: float = 25, chat_interval: float = 3, max_pending: int = 1000,
+                 max_retries: int = 5, logger=None):
+        self._workers_count = workers
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self._logger = logger
+        self.rate_limiter = TokenBucket(global_rate, max(int(global_rate), 1))
+
+        self._chats: Dict[Union[int, str], deque] = {}
+        self._next_send_at: Dict[Union[int, str], float] = {}
+        self._slots = asyncio.Semaphore(max_pending)
+        self._ready = None
+        self._idle = None
+        self._tasks = []
+
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    @property
+    def chats_count(self) -> int:
+        """number of chats with queued jobs"""
+        return len(self._chats)
+
+    async def submit(self, chat_id: Union[int, str], send: Callable[[], Awaitable]):
+        """add delivery to chat queue, waits while too many jobs are pending, send returning False is failed"""
+        await self._slots.acquire()
+        self.pending += 1
+        if self._idle:
+            self._idle.clear()
+        jobs = self._chats.get(chat_id)
+        if jobs is None:
+            self._chats[chat_id] = deque([SendJob(send)])
+            self._set_ready(chat_id)
+        else:
+            jobs.append(SendJob(send))
+
+    def _set_ready(self, chat_id: Union[int, str]):
+        """put chat to workers queue when its limits allow next send"""
+        if not self._ready:
+            return
+        delay = self._next_send_at.get(chat_id, 0) - time.monotonic()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+
+    def _finish_job(self, chat_id: Union[int, str], jobs: deque):
+        """drop sent or failed job and release its slot"""
+        jobs.popleft()
+        self.pending -= 1
+        self._slots.release()
+        if not jobs:
+            del self._chats[chat_id]
+        if not self.pending and self._idle:
+            self._idle.set()
+
+    async def _work(self):
+        """send first job of ready chat"""
+        while True:
+            chat_id = await self._ready.get()
+            jobs = self._chats.get(chat_id)
+            if not jobs:
+                continue
+            job = jobs[0]
+            await self.rate_limiter.acquire()
+            try:
+                is_sent = await job.send()
+            except RetryAfter as error:
+                self._next_send_at[chat_id] = time.monotonic() + error.timeout
+                job.retries += 1
+                self.retried += 1
+                if self._logger:
+                    self._logger.warning(f'Flood control for {chat_id}, retry in {error.timeout}s')
+                if job.retries > self.max_retries:
+                    self.failed += 1
+                    self._finish_job(chat_id, jobs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self.failed += 1
+                if self._logger:
+                    self._logger.error(f'While sending to {chat_id}: {error}')
+                self._finish_job(chat_id, jobs)
+            else:
+                if is_sent is False:
+                    self.failed += 1
+                else:
+                    self.sent += 1
+                self._next_send_at[chat_id] = time.monotonic() + self.chat_interval
+                self._finish_job(chat_id, jobs)
+            if chat_id in self._chats:
+                self._set_ready(chat_id)
+
+    async def start(self):
+        """start workers and serve already queued chats"""
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        if not self.pending:
+            self._idle.set()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._work(), name=f'telegram-sender-{number}')
+                       for number in range(self._workers_count)]
+        [self._set_ready(chat_id) for chat_id in self._chats]
+
+    async def stop(self, timeout: float = 0):
+        """wait up to timeout for queued jobs and stop workers, not sent jobs are dropped"""
+        if self._idle and timeout:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        [task.cancel() for task in self._tasks]
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._ready = None
+        self._idle = None
+        for _ in range(self.pending):
+            self._slots.release()
+        self.pending = 0
+        self._chats.clear()
+        self._next_send_at.clear()
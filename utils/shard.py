@@ -0,0 +1,150 @@
+import asyncio
+import math
+import os
+import socket
+import time
+from typing import Dict
+from typing import List
+
+from utils.models import CHANNEL_COLUMNS
+from utils.tokens import get_token_hash
+
+PAUSED_FLAG = 'shard_paused'
+
+
+def get_default_worker_id() -> str:
+    """get worker id unique between hosts and processes"""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class ShardWorker:
+    """run parser for vk sources leased from shared db
+
+    every heartbeat worker saves its stats, extends its leases and claims or releases sources to keep
+    its fair share of live workers, sources of dead workers are claimed when their leases expire
+
+    vk rate limits and daily quotas are counted per process, so every worker runs with own VK_TOKENS,
+    worker sharing a token with other live worker is not started, while coordinator paused the fleet
+    workers keep heartbeats but release their sources
+    """
+    def __init__(self, parser, db, worker_id: str = '', lease_ttl: float = 60, heartbeat_interval: float = 10,
+                 logger=None):
+        self.parser = parser
+        self._db = db
+        self.worker_id = worker_id or get_default_worker_id()
+        self.lease_ttl = lease_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self._logger = logger
+        self._task = None
+
+        self.sources: List[str] = []
+        self.paused = False
+
+    def get_stats(self) -> Dict:
+        """get worker stats shown by coordinator"""
+        return {'sources': len(self.sources), 'channels': len(self.parser.scheduled_channels),
+                'sent': self.parser.sender.sent, 'failed': self.parser.sender.failed, 'lag': self.parser.scheduler.lag}
+
+    async def _rebalance(self, now: float):
+        """claim or release leases to hold fair share of sources"""
+        expires_at = now + self.lease_ttl
+        sources = await self._db.renew_leases(self.worker_id, now, expires_at)
+        workers_count = max(len(await self._db.get_workers(now - self.lease_ttl)), 1)
+        fair_share = math.ceil(await self._db.count_sources() / workers_count)
+        if len(sources) < fair_share:
+            await self._db.claim_leases(self.worker_id, now, expires_at, fair_share - len(sources))
+            sources = await self._db.renew_leases(self.worker_id, now, expires_at)
+        elif len(sources) > fair_share:
+            await self.parser.state.flush()
+            await self._db.release_leases(self.worker_id, sources[fair_share:])
+            sources = sources[:fair_share]
+        self.sources = sources
+
+    async def _sync_channels(self, now: float):
+        """schedule channels of leased sources from their next due time, reschedule channels changed by coordinator
+
+        changed fields are copied to scheduled channel, so check running meanwhile does not lose its last post id
+        """
+        words = await self._db.get_blacklist_words()
+        if words != self.parser.blacklist_words:
+            self.parser.set_blacklist_words(words)
+        channels = {channel.id: channel for channel in await self._db.get_leased_channels(self.worker_id, now)}
+        removed_ids = [channel_id for channel_id in self.parser.scheduled_channels if channel_id not in channels]
+        if removed_ids:
+            await self.parser.state.flush()
+        for channel_id in removed_ids:
+            await self.parser.unschedule_channel(channel_id)
+        for channel_id, channel in channels.items():
+            scheduled_channel = self.parser.scheduled_channels.get(channel_id)
+            if scheduled_channel is None:
+                await self.parser.schedule_channel(channel, self.parser.get_start_delay(channel, now))
+            elif channel.revision > scheduled_channel.revision:
+                self.parser.state.discard(channel_id)
+                for column in CHANNEL_COLUMNS:
+                    setattr(scheduled_channel, column, getattr(channel, column))
+                await self.parser.schedule_channel(scheduled_channel)
+
+    async def _pause(self):
+        """release leases and unschedule channels while fleet is paused"""
+        if not self.paused:
+            await self._db.release_leases(self.worker_id, self.sources)
+            await self.parser.unschedule_all_channels()
+            self.sources = []
+            self.paused = True
+            if self._logger:
+                self._logger.info(f'Shard worker {self.worker_id} paused')
+
+    async def heartbeat(self):
+        """save stats, rebalance leases and sync channels unless fleet is paused"""
+        now = time.time()
+        await self.parser.state.flush()
+        await self._db.heartbeat_worker(self.worker_id, now, self.get_stats())
+        if await self._db.get_flag(PAUSED_FLAG):
+            await self._pause()
+            return
+        if self.paused and self._logger:
+            self._logger.info(f'Shard worker {self.worker_id} resumed')
+        self.paused = False
+        await self._rebalance(now)
+        await self._sync_channels(now)
+
+    async def claim_tokens(self):
+        """register vk tokens of worker, raise error when other live worker uses any of them"""
+        now = time.time()
+        await self._db.heartbeat_worker(self.worker_id, now, self.get_stats())
+        tokens = [get_token_hash(token.access_token) for token in self.parser.tokens.tokens]
+        shared_tokens = await self._db.claim_worker_tokens(self.worker_id, tokens, now - self.lease_ttl)
+        if shared_tokens:
+            await self._db.delete_worker(self.worker_id)
+            raise RuntimeError(f'Shard worker {self.worker_id} shares {len(shared_tokens)} VK tokens with other '
+                               f'live workers, set own VK_TOKENS for every worker')
+
+    async def _run(self):
+        """heartbeat every interval"""
+        while True:
+            try:
+                await self.heartbeat()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                if self._logger:
+                    self._logger.error(f'While shard worker {self.worker_id} heartbeat: {error}')
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def start(self):
+        """start heartbeats"""
+        if not self._task:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name='shard-heartbeat')
+            if self._logger:
+                self._logger.info(f'Shard worker {self.worker_id} started')
+
+    async def stop(self):
+        """stop heartbeats and release leases, parser should be stopped before to flush its state"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self.parser.state.flush()
+            await self._db.delete_worker(self.worker_id)
+            self.sources = []
+            self.paused = False
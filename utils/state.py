@@ -0,0 +1,68 @@
+import asyncio
+from typing import Any
+from typing import Dict
+
+from utils.models import Channel
+
+
+class ChannelStateTracker:
+    """keep changed channel fields in memory and write them to db by batches"""
+    def __init__(self, db, flush_interval: float = 10, logger=None):
+        self._db = db
+        self.flush_interval = flush_interval
+        self._logger = logger
+        self._dirty: Dict[int, Dict[str, Any]] = {}
+        self._task = None
+        self._lock = asyncio.Lock()
+
+        self.flushed_rows = 0
+
+    @property
+    def dirty_count(self) -> int:
+        """number of channels with not flushed changes"""
+        return len(self._dirty)
+
+    def update(self, channel_data: Channel, **fields):
+        """set channel fields and mark changed ones as dirty"""
+        for key, value in fields.items():
+            if getattr(channel_data, key) != value:
+                setattr(channel_data, key, value)
+                self._dirty.setdefault(channel_data.id, {})[key] = value
+
+    def discard(self, channel_id: int):
+        """drop not flushed changes of channel"""
+        self._dirty.pop(channel_id, None)
+
+    async def flush(self):
+        """write all dirty fields in one transaction"""
+        async with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            try:
+                await self._db.update_channels_fields(dirty)
+                self.flushed_rows += len(dirty)
+            except Exception as error:
+                for channel_id, fields in dirty.items():
+                    self._dirty[channel_id] = {**fields, **self._dirty.get(channel_id, {})}
+                if self._logger:
+                    self._logger.error(f'While flushing channels state: {error}')
+
+    async def _flush_periodically(self):
+        """flush dirty fields every flush interval"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self):
+        """start periodic flush"""
+        if not self._task:
+            self._task = asyncio.get_running_loop().create_task(self._flush_periodically(), name='state-flush')
+
+    async def stop(self):
+        """stop periodic flush and write remaining changes"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
@@ -0,0 +1,114 @@
+import hashlib
+import time
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from utils.rate_limiter import TokenBucket
+
+MOSCOW_OFFSET = 3 * 60 * 60
+
+
+def get_quota_day(now: float) -> int:
+    """get number of day used for vk daily quotas, they are reset at moscow midnight"""
+    return int((now + MOSCOW_OFFSET) // (24 * 60 * 60))
+
+
+def parse_tokens(value) -> List[str]:
+    """parse token or comma separated tokens, duplicates are dropped"""
+    tokens = value.split(',') if isinstance(value, str) else value
+    return list(dict.fromkeys(token.strip() for token in tokens if token and token.strip()))
+
+
+def get_token_hash(access_token: str) -> str:
+    """get token id safe to store in db"""
+    return hashlib.sha256(access_token.encode('utf-8')).hexdigest()[:16]
+
+
+class VkToken:
+    """vk access token with own rate limiter and daily method quota counters"""
+    def __init__(self, access_token: str, rate: float = 3, burst: int = 1, daily_limit: int = 0):
+        self.access_token = access_token
+        self.name = f'…{access_token[-4:]}'
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.daily_limit = daily_limit
+        self.disabled_until = 0.0
+        self.disabled_reason = ''
+        self._day = get_quota_day(time.time())
+        self._exhausted = set()
+
+        self.requests = 0
+        self.errors = 0
+        self.used_today: Dict[str, int] = {}
+
+    def _roll_day(self, now: float):
+        """reset daily counters when new quota day starts"""
+        day = get_quota_day(now)
+        if day != self._day:
+            self._day = day
+            self.used_today.clear()
+            self._exhausted.clear()
+
+    def is_available(self, method: str, now: float) -> bool:
+        """check token is not disabled and has quota left for method"""
+        self._roll_day(now)
+        if self.disabled_until > now or method in self._exhausted:
+            return False
+        return not self.daily_limit or self.used_today.get(method, 0) < self.daily_limit
+
+    def get_headroom(self, method: str) -> Tuple[float, float]:
+        """get sort key of token, free limiter tokens go first and remaining quota breaks ties"""
+        quota_left = self.daily_limit - self.used_today.get(method, 0) if self.daily_limit else float('inf')
+        return self.rate_limiter.available, quota_left
+
+    def record(self, method: str, calls: int = 1):
+        """count request and method calls against quota"""
+        self.requests += 1
+        self.used_today[method] = self.used_today.get(method, 0) + calls
+
+    def exhaust(self, method: str):
+        """mark method quota as used up until next quota day"""
+        self._exhausted.add(method)
+
+    def disable(self, seconds: float, reason: str, now: float):
+        """pull token out of rotation for a while"""
+        self.disabled_until = max(self.disabled_until, now + seconds)
+        self.disabled_reason = reason
+
+    def get_stats(self, now: float) -> Dict:
+        """get token usage shown in bot status"""
+        self._roll_day(now)
+        disabled_for = max(self.disabled_until - now, 0)
+        return {'name': self.name, 'requests': self.requests, 'errors': self.errors,
+                'used_today': dict(self.used_today), 'waiting': self.rate_limiter.waiting,
+                'exhausted': sorted(self._exhausted), 'disabled_for': disabled_for,
+                'disabled_reason': self.disabled_reason if disabled_for else ''}
+
+
+class TokenPool:
+    """vk tokens balanced by headroom, tokens failing with auth or flood errors are pulled out for a while"""
+    def __init__(self, access_tokens: Iterable[str], rate: float = 3, burst: int = 1, daily_limit: int = 0,
+                 disable_time: float = 600):
+        self.tokens = [VkToken(access_token, rate, burst, daily_limit) for access_token in access_tokens]
+        self.disable_time = disable_time
+
+    def __len__(self):
+        return len(self.tokens)
+
+    @property
+    def waiting(self) -> int:
+        """number of requests waiting for any token"""
+        return sum(token.rate_limiter.waiting for token in self.tokens)
+
+    def choose(self, method: str, now: Optional[float] = None) -> Optional[VkToken]:
+        """get available token with most headroom for method"""
+        now = time.time() if now is None else now
+        tokens = [token for token in self.tokens if token.is_available(method, now)]
+        return max(tokens, key=lambda token: token.get_headroom(method)) if tokens else None
+
+    def get_stats(self) -> List[Dict]:
+        """get usage of every token"""
+        now = time.time()
+        return [token.get_stats(now) for token in self.tokens]
@@ -1,14 +1,23 @@
+import copy
 import json
 import os
 from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Tuple
 
 from aiogram.types import InlineKeyboardButton
 from aiogram.types import InlineKeyboardMarkup
 from aiogram.utils.markdown import code
+from aiogram.utils.markdown import escape_md
 from aiogram.utils.markdown import text
 
+from utils.metrics import metrics
+from utils.models import Channel
+
 PATH = os.path.abspath(os.path.dirname(__file__))
+PAGINATION = 5
+SEARCH_PREFIX_LIMIT = 32
 
 
 def get_menu_kb(controller):
@@ -28,67 +37,140 @@ def get_accepted_keys() -> Dict:
     """get displayable keys"""
     return {0: 'is_active', 1: 'send_video_post', 2: 'send_video_post_text', 3: 'send_photo_post',
             4: 'send_photo_post_text', 5: 'send_text_post',
-            6: 'enable_filters'}
+            6: 'enable_filters', 7: 'adaptive_timer'}
+
 
+def parse_page_callback(callback_data: str) -> Tuple[Optional[int], int, bool, str]:
+    """parse item id or page cursor, direction and search prefix from callback data"""
+    query_data = callback_data.split('-', 3)
+    if len(query_data) == 2 and query_data[1].isdigit():
+        return int(query_data[1]), 0, False, ''
+    if len(query_data) > 2 and query_data[2].isdigit():
+        return None, int(query_data[2]), query_data[1] == 'back', query_data[3] if len(query_data) > 3 else ''
+    return None, 0, False, ''
 
-def get_blacklist_kb(controller, callback_name, page: int = None):
+
+async def get_blacklist_kb(controller, callback_name, cursor: int = 0, backward: bool = False, prefix: str = ''):
     """generate blacklist menu keyboard"""
-    words = controller.db.get_blacklist_words(get_id=True)
-    buttons = [InlineKeyboardButton(word['word'], callback_data=f'{callback_name}-{word["id"]}') for word in words]
-    return paginate_channels_buttons(buttons, callback_name, page)
+    words = await controller.db.get_blacklist_page(cursor, PAGINATION + 1, prefix, backward)
+    rows = [(word['id'], word['word']) for word in words]
+    return paginate_channels_buttons(rows, callback_name, cursor, backward, prefix)
 
 
-def get_channels_kb(controller, callback_name, page: int = None):
+async def get_channels_kb(controller, callback_name, cursor: int = 0, backward: bool = False, prefix: str = ''):
     """generate channels menu keyboard"""
-    channels = controller.db.get_all_channels()
-    buttons = [InlineKeyboardButton(f"{channel['vk_channel']} -> {channel['telegram_channel']}",
-                                    callback_data=f"{callback_name}-{channel['id']}") for channel in channels]
-    return paginate_channels_buttons(buttons, callback_name, page)
+    channels = await controller.db.get_channels_page(cursor, PAGINATION + 1, prefix, backward)
+    rows = [(channel['id'], f"{channel['vk_channel']} -> {channel['telegram_channel']}") for channel in channels]
+    return paginate_channels_buttons(rows, callback_name, cursor, backward, prefix)
 
 
-def paginate_channels_buttons(channels_buttons, callback_name, page: int = 0, pagination: int = 5):
-    """generate paginated keyboard menu"""
+def paginate_channels_buttons(page_rows: List[Tuple[int, str]], callback_name, cursor: int = 0,
+                              backward: bool = False, prefix: str = '', pagination: int = PAGINATION):
+    """generate keyboard menu from page rows fetched by keyset with one extra row to detect next page"""
     kb = InlineKeyboardMarkup()
     nav_buttons = [InlineKeyboardButton('ℹ Menu', callback_data='menu')]
-    if channels_buttons:
-        page_num = page if page else 0
-        pages_list = []
-        for i in range(0, len(channels_buttons), pagination):
-            channels = channels_buttons[i:i + pagination]
-            for channel in channels:
-                channel.callback_data = f"{channel.callback_data}-{i}"
-            pages_list.append(channels)
-        pages_dict = {}
-        [pages_dict.update({counter: page}) for counter, page in enumerate(pages_list)]
-        [kb.add(button) for button in pages_dict.get(page_num)]
-        if page_num:
-            nav_buttons.append(InlineKeyboardButton('◀ Back', callback_data=f'{callback_name}-page-{page_num - 1}'))
-        if page_num + 1 < len(pages_dict):
-            nav_buttons.append(InlineKeyboardButton('▶ Next', callback_data=f'{callback_name}-page-{page_num + 1}'))
+    has_more = len(page_rows) > pagination
+    page_rows = page_rows[-pagination:] if backward else page_rows[:pagination]
+    if page_rows:
+        [kb.add(InlineKeyboardButton(title, callback_data=f'{callback_name}-{row_id}')) for row_id, title in page_rows]
+        search_suffix = f'-{prefix}' if prefix else ''
+        if has_more if backward else cursor:
+            nav_buttons.append(InlineKeyboardButton(
+                '◀ Back', callback_data=f'{callback_name}-back-{page_rows[0][0]}{search_suffix}'))
+        if cursor if backward else has_more:
+            nav_buttons.append(InlineKeyboardButton(
+                '▶ Next', callback_data=f'{callback_name}-page-{page_rows[-1][0]}{search_suffix}'))
     return kb.row(*nav_buttons)
 
 
-def get_bot_status(controller):
+def format_token_status(token: Dict) -> str:
+    """format vk token usage line of bot status"""
+    used_today = ', '.join(f'{method} {calls}' for method, calls in token['used_today'].items())
+    status = (f"`{escape_md(token['name'])}`: requests *{token['requests']}*, errors *{token['errors']}*, "
+              f"waiting *{token['waiting']}*, today {escape_md(used_today) or '0'}")
+    if token['disabled_for']:
+        status += f" 🔴 *{int(token['disabled_for'])}s* \\({escape_md(token['disabled_reason'])}\\)"
+    if token['exhausted']:
+        status += f" 🟡 quota: {escape_md(', '.join(token['exhausted']))}"
+    return status
+
+
+async def get_bot_status(controller):
     """get status information"""
-    tasks = controller.parser.channels_tasks
-    active_channels = 'Running: *0/0*' if bool(controller.is_working) else ''
-    if tasks:
-        running_tasks = [1 for task_id, data in tasks.items() if not data['task'].done()]
-        active_channels = f'Running: *{sum(running_tasks)}/{len(tasks)}*'
+    scheduler = controller.parser.scheduler
+    if controller.coordinator:
+        await controller.update_fleet_state()
+    active_channels = ''
+    if controller.is_working and not controller.coordinator:
+        active_channels = text(f'Running: *{len(controller.parser.scheduled_channels)}*',
+                               f'VK sources: *{scheduler.busy_workers}/{len(scheduler)}*',
+                               f'Queue depth: *{scheduler.queue_depth}*',
+                               f'Pipeline queue: *{controller.parser.pipeline.depth}*',
+                               f'Lag: *{int(scheduler.lag)}s* \\(max *{int(scheduler.max_lag)}s*\\)',
+                               f'Telegram queue: *{controller.parser.sender.pending}*', sep='\n')
+
+    workers_status = ''
+    if controller.sharded:
+        workers = await controller.get_workers()
+        workers_status = text(f'Shard workers: *{len(workers)}*',
+                              *[f"`{escape_md(worker['id'])}`: sources *{worker['sources']}*, "
+                                f"channels *{worker['channels']}*, sent *{worker['sent']}*, "
+                                f"failed *{worker['failed']}*, lag *{int(worker['lag'])}s*" for worker in workers],
+                              f"Total sent: *{sum(worker['sent'] for worker in workers)}*\n", sep='\n')
+
+    tokens_status = text(*[format_token_status(token) for token in controller.parser.tokens.get_stats()], sep='\n')
 
     working_status = '🟢' if bool(controller.is_working) else '🔴'
+    connection_stats = controller.parser.connection_stats
 
     msg = text(f'Working status: *{working_status}*',
                f"{active_channels}\n",
-               f'Channels in db: *{len(controller.db.get_all_channels())}*',
+               *([workers_status] if workers_status else []),
+               f"VK requests: *{connection_stats['requests']}*",
+               f"VK connections: *{connection_stats['created']}* opened, *{connection_stats['reused']}* reused",
+               f'VK tokens: *{len(controller.parser.tokens)}*',
+               f'{tokens_status}\n',
+               f'Channels in db: *{len(controller.channels)}* \\(active *{controller.channels.active_count}*\\)',
                f'Words in blacklist: *{len(controller.parser.blacklist_words)}*',
                sep='\n')
     return msg
 
 
-def get_channel_detail_kb(controller, channel_id):
+async def get_stats():
+    """get metrics summary"""
+    def latency(name: str) -> str:
+        histogram = metrics.get(name)
+        return (f'p50 {histogram.quantile(0.5):.3f}s, p99 {histogram.quantile(0.99):.3f}s, '
+                f'n {histogram.count()}') if histogram else '-'
+
+    vk_requests = metrics.get('vk_requests_total')
+    vk_errors = metrics.get('vk_errors_total')
+    posts = metrics.get('posts_total')
+    sent_posts = metrics.get('telegram_posts_total')
+    lag = metrics.get('delivery_lag_seconds')
+    limiter_wait = metrics.get('vk_rate_limiter_wait_seconds')
+
+    lines = ['VK requests: ' + ', '.join(f'{method} {int(value)}' for (method,), value in vk_requests.values.items()),
+             'VK errors: ' + ', '.join(f'{method}/{error} {int(value)}'
+                                       for (method, error), value in vk_errors.values.items()),
+             f'VK latency: {latency("vk_request_duration_seconds")}',
+             f'VK limiter wait: avg {limiter_wait.mean():.3f}s, p99 {limiter_wait.quantile(0.99):.3f}s',
+             f'Check channel: {latency("check_channel_duration_seconds")}',
+             f'Prepare content: {latency("prepare_content_duration_seconds")}',
+             f'Send content: {latency("send_content_duration_seconds")}',
+             'Posts: ' + ', '.join(f'{result} {int(value)}' for (result,), value in posts.values.items()),
+             'Telegram: ' + ', '.join(f'{result} {int(value)}' for (result,), value in sent_posts.values.items()),
+             f'Delivery lag: p50 {int(lag.quantile(0.5))}s, p99 {int(lag.quantile(0.99))}s, n {lag.count()}',
+             'Queues: ' + ', '.join(f'{name} {int(metrics.get(name).get())}'
+                                    for name in ('scheduler_queue_depth', 'vk_rate_limiter_waiting',
+                                                 'telegram_queue_depth', 'state_dirty_channels')
+                                    if metrics.get(name))]
+    return code('\n'.join(lines))
+
+
+async def get_channel_detail_kb(controller, channel_id):
     """generate channel detail keyboard menu"""
-    channel_data = controller.db.get_channel(channel_id)
+    channel_data = await controller.get_channel(channel_id)
     kb = InlineKeyboardMarkup()
     if channel_data:
         channel = channel_data[0]
@@ -96,10 +178,10 @@ def get_channel_detail_kb(controller, channel_id):
         accepted_keys = get_accepted_keys()
         for index, value in accepted_keys.items():
             name = ' '.join(value.split('_')).title()
-            flag = 'On 🟢' if channel[value] else 'Off 🔴'
+            flag = 'On 🟢' if getattr(channel, value) else 'Off 🔴'
             callback_data = f'edit-{channel_id}-{index}'
             if value == 'is_active':
-                kb.add(InlineKeyboardButton('Disable' if channel['is_active'] else 'Enable',
+                kb.add(InlineKeyboardButton('Disable' if channel.is_active else 'Enable',
                                             callback_data=callback_data))
             else:
                 kb.add(InlineKeyboardButton(f'{name}: {flag}', callback_data=callback_data))
@@ -112,15 +194,23 @@ def get_channel_detail_kb(controller, channel_id):
     return kb, code(json.dumps(format_channel_preview(channel_data[0]), indent=2))
 
 
-def format_channel_preview(channel_data):
+def format_channel_preview(channel_data: Channel):
     """generate channel info text in channel detail menu"""
-    return {'telegram_channel': channel_data['telegram_channel'], 'vk_channel': channel_data['vk_channel'],
-            'last_post_id': get_preview_for_last_id(channel_data), 'timer': channel_data['timer']}
+    return {'telegram_channel': channel_data.telegram_channel, 'vk_channel': channel_data.vk_channel,
+            'last_post_id': get_preview_for_last_id(channel_data), 'timer': channel_data.timer,
+            'health': get_preview_for_health(channel_data)}
+
+
+def get_preview_for_health(channel_data: Channel):
+    """generate preview for vk source circuit breaker state"""
+    if not channel_data.last_error:
+        return channel_data.health_state
+    return f"{channel_data.health_state} ({channel_data.health_failures}x {channel_data.last_error})"
 
 
-def get_preview_for_last_id(channel_data):
+def get_preview_for_last_id(channel_data: Channel):
     """generate preview for last_post_id param"""
-    return 'will set' if channel_data['set_last_post_id'] else channel_data['last_post_id']
+    return 'will set' if channel_data.set_last_post_id else channel_data.last_post_id
 
 
 async def normalize_channel_name(channel_name):
@@ -129,15 +219,16 @@ async def normalize_channel_name(channel_name):
     return f'@{channel_name}' if not is_num else channel_name
 
 
-async def get_post_url(channel_data: Dict, post: Dict) -> str:
+async def get_post_url(channel_data: Channel, post: Dict) -> str:
     """create vk post url"""
-    return f"https://vk.com/{channel_data['vk_channel']}?w=wall{post['from_id']}_{post['id']}"
+    return f"https://vk.com/{channel_data.vk_channel}?w=wall{post['from_id']}_{post['id']}"
 
 
 async def clear_media_caption(medias: List):
-    """clearing media caption"""
+    """get copies of media without caption, original media are kept for retries"""
     medias_cleared = []
     for media in medias:
-        media.caption = ''
-        medias_cleared.append(media)
+        media_cleared = copy.deepcopy(media)
+        media_cleared.caption = ''
+        medias_cleared.append(media_cleared)
     return medias_cleared
@@ -1,190 +1,521 @@
-import asyncio
-from collections import defaultdict
+import time
+from functools import partial
 from typing import Dict
 from typing import List
-from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from typing import Union
 
 from aiogram import Bot
 from aiogram.types import InputMediaPhoto
 from aiogram.types import InputMediaVideo
+from aiogram.utils.exceptions import RetryAfter
 
+from config.settings import ADAPTIVE_TIMER_ALPHA
+from config.settings import ADAPTIVE_TIMER_MAX
+from config.settings import ADAPTIVE_TIMER_MIN
+from config.settings import ADMIN_DIGEST_INTERVAL
+from config.settings import ADMIN_DIGEST_SAMPLE
 from config.settings import ADMIN_ID
+from config.settings import BLACKLIST_CASE_FOLD
+from config.settings import BLACKLIST_WORD_BOUNDARY
+from config.settings import CONTENT_DEDUP_CACHE_SIZE
+from config.settings import CONTENT_DEDUP_TTL
+from config.settings import PIPELINE_QUEUE_SIZE
+from config.settings import PIPELINE_WORKERS
+from config.settings import SCHEDULER_QUEUE_SIZE
+from config.settings import SCHEDULER_WORKERS
+from config.settings import STARTUP_SPREAD_MAX
+from config.settings import STATE_FLUSH_INTERVAL
+from config.settings import TELEGRAM_CHAT_INTERVAL
+from config.settings import TELEGRAM_DRAIN_TIMEOUT
+from config.settings import TELEGRAM_GLOBAL_RATE
+from config.settings import TELEGRAM_MAX_PENDING
+from config.settings import TELEGRAM_MAX_RETRIES
+from config.settings import TELEGRAM_SEND_WORKERS
+from config.settings import VK_BREAKER_JITTER
+from config.settings import VK_BREAKER_MAX_BACKOFF
+from config.settings import VK_BREAKER_THRESHOLD
+from config.settings import VK_CALLBACK_CONFIRMATIONS
+from config.settings import VK_CALLBACK_HOST
+from config.settings import VK_CALLBACK_PATH
+from config.settings import VK_CALLBACK_PORT
+from config.settings import VK_CALLBACK_SECRET
+from config.settings import VK_LONG_POLL_GROUPS
+from config.settings import VK_LONG_POLL_WAIT
+from config.settings import VK_PUSH_POLL_INTERVAL
+from config.settings import VK_WALL_COUNT_MAX
+from config.settings import VK_WALL_COUNT_MIN
 from utils.api import VkApi
-from utils.db import DbController
+from utils.blacklist import BlacklistMatcher
+from utils.db import AsyncDbController
+from utils.dedup import ContentIndex
+from utils.dedup import get_post_fingerprints
+from utils.digest import ErrorDigest
+from utils.health import ErrorKind
+from utils.health import HealthState
+from utils.health import SourceHealth
+from utils.health import classify_error
+from utils.metrics import LAG_BUCKETS
+from utils.metrics import metrics
+from utils.models import Attachments
+from utils.models import Channel
+from utils.models import Link
+from utils.models import Post
+from utils.models import Video
+from utils.pipeline import PartitionedStage
+from utils.push import CallbackReceiver
+from utils.push import LongPollClient
+from utils.push import parse_group_values
+from utils.registry import ChannelRegistry
+from utils.scheduler import Scheduler
+from utils.sender import TelegramDispatcher
+from utils.state import ChannelStateTracker
 from utils.utils import clear_media_caption
 from utils.utils import get_post_url
 from utils.utils import normalize_channel_name
 
 
-class Post(NamedTuple):
-    """Contains parsed vk post"""
-    id: int
-    owner_id: int
-    date: int
-    text: str
-    attachments: Dict
+GOLDEN_RATIO_FRACTION = 0.6180339887498949
+
+CHECK_DURATION = metrics.histogram('check_channel_duration_seconds', 'Time to filter and queue posts of channel')
+PREPARE_DURATION = metrics.histogram('prepare_content_duration_seconds', 'Time to prepare post content')
+SEND_DURATION = metrics.histogram('send_content_duration_seconds', 'Time to send post to telegram')
+POSTS = metrics.counter('posts_total', 'Checked posts by result', ('result',))
+SENT_POSTS = metrics.counter('telegram_posts_total', 'Telegram deliveries by result', ('result',))
+DELIVERY_LAG = metrics.histogram('delivery_lag_seconds', 'Time from vk post publish to telegram delivery',
+                                 buckets=LAG_BUCKETS)
+SOURCE_ERRORS = metrics.counter('source_errors_total', 'Failed vk source checks by error kind', ('kind',))
+CHANNEL_DELIVERY_LAG = metrics.gauge('channel_delivery_lag_seconds', 'Last vk publish to telegram delivery lag',
+                                     ('telegram_channel',))
 
 
 class VkParser(VkApi):
-    def __init__(self, access_token: str, bot: Bot, logger):
+    def __init__(self, access_token: Union[str, List[str]], bot: Bot, logger):
         super().__init__(access_token)
 
         self.bot = bot
         self.logger = logger
-        self.db = DbController()
-        self.blacklist_words = self.db.get_blacklist_words()
-        self.channels = self.db.get_all_channels()
-        self.loop = asyncio.get_event_loop()
+        self.db = AsyncDbController()
+        self.blacklist_words = []
+        self.blacklist = BlacklistMatcher(self.blacklist_words, BLACKLIST_WORD_BOUNDARY, BLACKLIST_CASE_FOLD)
+        self.channels = ChannelRegistry()
+        self.content_index = ContentIndex(self.db, CONTENT_DEDUP_TTL, CONTENT_DEDUP_CACHE_SIZE)
+        self.state = ChannelStateTracker(self.db, STATE_FLUSH_INTERVAL, logger)
+
+        self.scheduled_channels = {}
+        self.sources = {}
+        self.owners = {}
+        self.wall_counts = {}
+        self.health: Dict[str, SourceHealth] = {}
+        self.scheduler = Scheduler(self._check_scheduled_source, SCHEDULER_WORKERS, SCHEDULER_QUEUE_SIZE, logger)
+        self.pipeline = PartitionedStage(self._process_source_posts, PIPELINE_WORKERS, PIPELINE_QUEUE_SIZE, logger,
+                                         'posts')
+        self.sender = TelegramDispatcher(TELEGRAM_SEND_WORKERS, TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_INTERVAL,
+                                         TELEGRAM_MAX_PENDING, TELEGRAM_MAX_RETRIES, logger)
+        self.errors_digest = ErrorDigest(self.send_admin_message, ADMIN_DIGEST_INTERVAL, ADMIN_DIGEST_SAMPLE, logger)
+        self.callback_receiver = CallbackReceiver(self.push_post, parse_group_values(VK_CALLBACK_CONFIRMATIONS),
+                                                  VK_CALLBACK_SECRET, VK_CALLBACK_PORT, VK_CALLBACK_HOST,
+                                                  VK_CALLBACK_PATH, logger)
+        self.long_poll_clients = [LongPollClient(self, group_id, token, self.push_post, VK_LONG_POLL_WAIT, logger)
+                                  for group_id, token in parse_group_values(VK_LONG_POLL_GROUPS).items()]
+        push_groups = {client.group_id for client in self.long_poll_clients}
+        if VK_CALLBACK_PORT:
+            push_groups |= self.callback_receiver.group_ids
+        self.push_owners = {-group_id for group_id in push_groups}
+        self._register_metrics()
 
-        self.channels_tasks = {}
+    def _register_metrics(self):
+        """expose queues state as gauges"""
+        metrics.gauge('scheduler_queue_depth', 'VK sources due but not picked by workers',
+                      callback=lambda: self.scheduler.queue_depth)
+        metrics.gauge('scheduler_lag_seconds', 'Last delay between source due time and its check',
+                      callback=lambda: self.scheduler.lag)
+        metrics.gauge('scheduled_sources', 'VK sources in scheduler', callback=lambda: len(self.sources))
+        metrics.gauge('pipeline_queue_depth', 'Fetched vk sources waiting to be processed',
+                      callback=lambda: self.pipeline.depth)
+        metrics.gauge('vk_rate_limiter_waiting', 'Requests waiting for VK rate limiter tokens',
+                      callback=lambda: self.tokens.waiting)
+        metrics.gauge('telegram_queue_depth', 'Telegram deliveries waiting to be sent',
+                      callback=lambda: self.sender.pending)
+        metrics.gauge('state_dirty_channels', 'Channels with not flushed state',
+                      callback=lambda: self.state.dirty_count)
 
-    async def _parse_post_attachment(self, attachments: List[Dict]) -> Dict:
+    async def _parse_post_attachment(self, attachments: List[Dict]) -> Attachments:
         """parse post attachments by type"""
-        parsed_attachments = defaultdict(list)
+        photos, videos, links = [], [], []
         for attachment in attachments:
             attachment_type = attachment.get('type')
             if attachment_type == 'photo':
-                parsed_attachments[attachment_type].append(attachment['photo']['sizes'][-1]['url'])
+                photos.append(attachment['photo']['sizes'][-1]['url'])
             elif attachment_type == 'video':
                 parsed_video = await self._parse_video(attachment)
-                if parsed_video['platform'] == 'youtube':
-                    parsed_attachments['link'].append(parsed_video) if parsed_video['url'] else ''
+                if parsed_video.platform == 'youtube':
+                    links.append(Link(parsed_video.title, parsed_video.url)) if parsed_video.url else ''
                 else:
-                    parsed_attachments[attachment_type].append(parsed_video['id'])
+                    videos.append(parsed_video.id)
             elif attachment_type == 'link':
                 link = attachment['link']
                 link_title = await self._prepare_markdown_text(link['title']) if link.get('title') else 'link'
-                parsed_attachments[attachment_type].append({'title': link_title, 'url': link['url']})
-        return parsed_attachments
+                links.append(Link(link_title, link['url']))
+        return Attachments(tuple(photos), tuple(videos), tuple(links))
 
     async def _parse_post(self, data: Dict) -> Post:
         """parse post dict to Post entity"""
-        attachments = await self._parse_post_attachment(data['attachments']) if data.get('attachments') else dict()
+        attachments = Attachments()
+        if data.get('attachments'):
+            attachments = await self._parse_post_attachment(data['attachments'])
         return Post(id=data['id'], owner_id=data['owner_id'], date=data['date'],
-                    text=data['text'], attachments=attachments)
+                    text=data['text'], attachments=attachments, fingerprints=get_post_fingerprints(data))
 
-    async def _parse_video(self, video_data: Dict) -> Dict:
+    async def _parse_video(self, video_data: Dict) -> Video:
         """parse video from vk api json"""
         video = video_data['video']
         video_title = 'video' if not video.get('title') else await self._prepare_markdown_text(video['title'])
-        video_id = f"{video['owner_id']}_{video['id']}_{video['access_key']}"
+        video_id = self.get_video_id(video)
         video_platform = video.get('platform').lower() if video.get('platform') else ''
-        video_data = await self.get_video_data(video_id)
-        video_url = video_data['response']['items'][0]['files'].get('external')
-        return {'title': video_title, 'url': video_url if video_url else '',
-                'platform': video_platform, 'id': video_id}
+        video_data = await self.get_video(video_id)
+        video_url = video_data.get('files', {}).get('external')
+        return Video(video_id, video_title, video_url if video_url else '', video_platform)
 
     @staticmethod
     async def _prepare_markdown_text(text: str) -> str:
         """convert text to markdown"""
         return text.replace('[', '(').replace(']', ')')
 
+    def get_posts_video_ids(self, posts: List[Dict]) -> List[str]:
+        """get ids of videos attached to posts"""
+        return [self.get_video_id(attachment['video']) for post in posts
+                for attachment in post.get('attachments', []) if attachment.get('type') == 'video']
+
+    def request_videos(self, posts: List[Dict]):
+        """add not cached videos of posts to shared video.get batch without waiting for it"""
+        self.video_batcher.request([video_id for video_id in self.get_posts_video_ids(posts)
+                                    if self.video_cache.get(video_id) is None])
+
+    async def prefetch_videos(self, posts: List[Dict]):
+        """resolve videos of all posts to fill video cache, ids requested by source fetch are awaited"""
+        video_ids = self.get_posts_video_ids(posts)
+        if video_ids:
+            await self.get_videos(video_ids)
+
+    async def is_duplicate_post(self, channel_data: Channel, parsed_post: Post) -> bool:
+        """check if same content was already sent to telegram channel"""
+        return await self.content_index.is_duplicate(channel_data.telegram_channel, parsed_post.fingerprints)
+
+    def set_blacklist_words(self, words: List[str]):
+        """replace blacklist words and rebuild matcher"""
+        self.blacklist_words = list(words)
+        self.blacklist.build(self.blacklist_words)
+
     async def is_allowed_post(self, data: Dict) -> bool:
         """check post for blacklist words, advertisement and copyrights"""
-        is_allowed_text = not bool([True for word in self.blacklist_words if word in data.get('text')])
+        is_allowed_text = not self.blacklist.search(data.get('text'))
         is_ads = data.get('marked_as_ads')
         is_shared = data.get('copyright')
         is_pinned = data.get('is_pinned')
         if is_allowed_text and not is_ads and not is_shared and not is_pinned:
             return True
 
-    async def close_all_channels_tasks(self):
-        """close all channels running tasks"""
-        if self.channels_tasks:
-            [data['task'].cancel() for task_id, data in self.channels_tasks.items()]
-            self.channels_tasks.clear()
-
-    async def close_channel_task(self, task_id: int):
-        """close channel check task"""
-        data = self.channels_tasks.get(task_id)
-        if self.channels_tasks and data:
-            data['task'].cancel()
-            del self.channels_tasks[task_id]
-        self.logger.debug(f'Closed channel task with id: {task_id}')
-
-    async def create_channel_task(self, channel_data: Dict):
-        """create channel check task"""
-        task = self.loop.create_task(self.check_channel(channel_data), name=channel_data['id'])
-        self.channels_tasks[channel_data['id']] = {'channel_data': channel_data, 'task': task}
-        self.logger.debug(f'Created channel task for {channel_data["telegram_channel"]} (id: {channel_data["id"]})')
+    async def unschedule_all_channels(self):
+        """remove all channels from scheduler"""
+        self.scheduler.clear()
+        self.scheduled_channels.clear()
+        self.sources.clear()
+        self.owners.clear()
+        self.wall_counts.clear()
+        self.health.clear()
+
+    async def unschedule_channel(self, channel_id: int):
+        """remove channel from its vk source, source without channels is removed from scheduler"""
+        channel_data = self.scheduled_channels.pop(channel_id, None)
+        if channel_data:
+            source = self.sources.get(channel_data.vk_channel, {})
+            source.pop(channel_id, None)
+            if not source:
+                self.sources.pop(channel_data.vk_channel, None)
+                self.scheduler.remove(channel_data.vk_channel)
+                self.wall_counts.pop(channel_data.vk_channel, None)
+                self.health.pop(channel_data.vk_channel, None)
+                if self.owners.get(channel_data.vk_channel_id) == channel_data.vk_channel:
+                    del self.owners[channel_data.vk_channel_id]
+        self.logger.debug(f'Unscheduled channel with id: {channel_id}')
+
+    async def schedule_channel(self, channel_data: Channel, delay: float = 0):
+        """add channel to its vk source and change source next check time, open source waits for its backoff"""
+        await self.unschedule_channel(channel_data.id)
+        self.scheduled_channels[channel_data.id] = channel_data
+        self.sources.setdefault(channel_data.vk_channel, {})[channel_data.id] = channel_data
+        if channel_data.vk_channel_id:
+            self.owners[channel_data.vk_channel_id] = channel_data.vk_channel
+        health = self.health.get(channel_data.vk_channel)
+        if health is None:
+            health = self.health[channel_data.vk_channel] = SourceHealth.from_channels(
+                [channel_data], threshold=VK_BREAKER_THRESHOLD, max_backoff=60 * VK_BREAKER_MAX_BACKOFF,
+                jitter=VK_BREAKER_JITTER)
+        self.scheduler.schedule(channel_data.vk_channel, max(delay, health.get_delay()))
+        self.logger.debug(f'Scheduled channel {channel_data.telegram_channel} (id: {channel_data.id})')
 
     @staticmethod
-    async def set_last_post_id(channel_data: Dict, posts: List):
+    def get_channel_interval(channel_data: Channel) -> int:
+        """get seconds between channel checks, adaptive timer polls twice per expected post interval"""
+        interval = 60 * int(channel_data.timer) if channel_data.timer else 60 * 60
+        if channel_data.adaptive_timer and channel_data.post_interval:
+            silence = time.time() - channel_data.last_post_date
+            expected_interval = max(channel_data.post_interval, silence)
+            interval = min(max(expected_interval / 2, 60 * ADAPTIVE_TIMER_MIN), 60 * ADAPTIVE_TIMER_MAX)
+        return int(interval)
+
+    async def update_post_interval(self, channel_data: Channel, posts: List):
+        """update moving average of interval between channel posts"""
+        last_post_date, average = channel_data.last_post_date, channel_data.post_interval
+        posts_dates = [post['date'] for post in posts if not post.get('is_pinned') and post['date'] > last_post_date]
+        for post_date in sorted(posts_dates):
+            if last_post_date:
+                delta = post_date - last_post_date
+                average = ADAPTIVE_TIMER_ALPHA * delta + (1 - ADAPTIVE_TIMER_ALPHA) * average if average else delta
+            last_post_date = post_date
+        self.state.update(channel_data, last_post_date=last_post_date, post_interval=average)
+        return channel_data
+
+    @staticmethod
+    def get_start_jitter(channel_id: int) -> float:
+        """get stable fraction of interval for channel first check, consecutive ids are spread evenly"""
+        return (channel_id * GOLDEN_RATIO_FRACTION) % 1
+
+    def get_start_delay(self, channel_data: Channel, now: float) -> float:
+        """get delay of first check after start, persisted next due time is resumed
+
+        channels without it or overdue ones are spread over their interval, limited by STARTUP_SPREAD_MAX
+        """
+        interval = self.get_channel_interval(channel_data)
+        next_due = channel_data.next_due or 0
+        if next_due > now:
+            return min(next_due - now, interval)
+        return min(interval, 60 * STARTUP_SPREAD_MAX) * self.get_start_jitter(channel_data.id)
+
+    async def _check_scheduled_source(self, vk_channel: str):
+        """check vk source picked by scheduler and return delay until next check, next due time is persisted"""
+        channels = list(self.sources.get(vk_channel, {}).values())
+        if not channels:
+            return None
+        delay = await self.check_guarded_source(vk_channel, channels)
+        if delay is not None:
+            next_due = int(time.time() + delay)
+            for channel_data in channels:
+                self.state.update(channel_data, next_due=next_due)
+        return delay
+
+    async def check_guarded_source(self, vk_channel: str, channels: List[Channel]) -> Optional[float]:
+        """check vk source through its circuit breaker and return delay until next check"""
+        health = self.health[vk_channel]
+        health.begin_check()
+        try:
+            error = await self.check_source(vk_channel, channels)
+        except Exception as exception:
+            error = {'error_code': type(exception).__name__, 'error_msg': str(exception)}
+        interval = min(self.get_channel_interval(channel_data) for channel_data in channels)
+        if channels[0].vk_channel_id in self.push_owners:
+            interval = max(interval, 60 * VK_PUSH_POLL_INTERVAL)
+        if error:
+            return await self.handle_source_error(vk_channel, channels, error, interval)
+        if health.record_success():
+            self.logger.info(f'VK source {vk_channel} recovered')
+        self.save_source_health(channels, health)
+        return interval
+
+    def save_source_health(self, channels: List[Channel], health: SourceHealth):
+        """persist breaker state in channels rows"""
+        for channel_data in channels:
+            self.state.update(channel_data, **health.fields)
+
+    async def handle_source_error(self, vk_channel: str, channels: List[Channel], error: Dict,
+                                  interval: float) -> Optional[float]:
+        """open source breaker or disable its channels on permanent error, return delay until next check"""
+        health = self.health[vk_channel]
+        kind = classify_error(error.get('error_code'))
+        message = f"{error.get('error_code')}: {error.get('error_msg')}"
+        SOURCE_ERRORS.inc(kind)
+        if kind == ErrorKind.permanent:
+            health.disable(message)
+            for channel_data in channels:
+                self.state.update(channel_data, is_active=0, **health.fields)
+                if self.channels.get(channel_data.id) is channel_data:
+                    self.channels.add(channel_data)
+                await self.unschedule_channel(channel_data.id)
+            self.logger.warning(f'Disabled {len(channels)} channels of {vk_channel} after error {message}')
+            self.errors_digest.add('VK disabled', error.get('error_code'), error.get('error_msg'), vk_channel)
+            return None
+        delay = health.record_failure(kind, message, interval)
+        self.save_source_health(channels, health)
+        self.logger.warning(f'Check of {vk_channel} failed ({health.failures} in a row, {health.state}): {message}')
+        category = 'VK paused' if health.state == HealthState.open else 'VK'
+        self.errors_digest.add(category, error.get('error_code'), error.get('error_msg'), vk_channel)
+        return delay
+
+    async def set_last_post_id(self, channel_data: Channel, posts: List):
         """set last post id in channel_data"""
-        if channel_data['set_last_post_id']:
+        if channel_data.set_last_post_id:
             posts_id = [post['id'] for post in posts]
             posts_id.sort()
-            channel_data['last_post_id'] = posts_id[-1]
-            channel_data['set_last_post_id'] = 0
+            self.state.update(channel_data, last_post_id=posts_id[-1], set_last_post_id=0)
         return channel_data
 
-    async def check_channel(self, channel_data: Dict):
-        """check vk channel for new posts and filter them"""
-        while True:
-            wall_posts = await self.get_wall_posts(channel_data)
-            is_correct = wall_posts.get('response') and wall_posts.get('response').get('count')
-            if is_correct:
-                posts = wall_posts['response']['items']
-                channel_data = await self.set_last_post_id(channel_data, posts)
-                for post in reversed(posts):
-                    post_id = int(post.get('id'))
-                    is_allowed_post = True if not channel_data['enable_filters'] else await self.is_allowed_post(post)
-                    if post_id > channel_data['last_post_id'] and is_allowed_post:
-                        channel_data['last_post_id'] = post_id
-                        parsed_post = await self._parse_post(post)
-                        post_url = await get_post_url(channel_data, post)
-                        prepared_content = await self.prepare_content(channel_data, parsed_post)
-                        if prepared_content:
-                            self.logger.info(f'Found new post from {channel_data["vk_channel"]} -> '
-                                             f'{channel_data["telegram_channel"]}')
-                            await self.send_content(channel_data, prepared_content, post_url)
-                            break
-                else:
-                    self.logger.info(f'No new posts from {channel_data["vk_channel"]}')
-                self.db.update_channel(channel_data['id'], channel_data)
-            else:
-                self.logger.info(f'No correct posts for {channel_data["vk_channel"]}')
-                await self.bot.send_message(ADMIN_ID, f'Error: {wall_posts.get("error").get("error_msg")}')
+    def get_wall_count(self, vk_channel: str, channels: List[Channel]) -> int:
+        """get number of wall posts to request, few more than number of new posts found last time"""
+        if all(channel_data.set_last_post_id for channel_data in channels):
+            return VK_WALL_COUNT_MIN
+        return self.wall_counts.get(vk_channel, VK_WALL_COUNT_MIN)
+
+    @staticmethod
+    def is_wall_gap(posts: List[Dict], count: int, last_post_id: int) -> bool:
+        """check if posts older than requested ones can be new too"""
+        return len(posts) >= count and all(post['id'] > last_post_id for post in posts if not post.get('is_pinned'))
+
+    async def check_source(self, vk_channel: str, channels: List[Channel]) -> Optional[Dict]:
+        """fetch vk wall once and check new posts for every subscribed telegram channel, return vk error
+
+        request count is trimmed to recent number of new posts and widened to max when new posts may be missed
+        """
+        count = self.get_wall_count(vk_channel, channels)
+        wall_posts = await self.get_wall_posts(channels[0], count)
+        if 'response' not in wall_posts:
+            return wall_posts.get('error') or {'error_code': 0, 'error_msg': 'Unknown vk response'}
+        posts = (wall_posts['response'] or {}).get('items')
+        if posts:
+            last_post_id = min((channel_data.last_post_id for channel_data in channels
+                                if not channel_data.set_last_post_id), default=None)
+            if last_post_id is not None:
+                if count < VK_WALL_COUNT_MAX and self.is_wall_gap(posts, count, last_post_id):
+                    self.logger.debug(f'Request {VK_WALL_COUNT_MAX} posts from {vk_channel} to fill the gap')
+                    wall_posts = await self.get_wall_posts(channels[0], VK_WALL_COUNT_MAX)
+                    posts = (wall_posts.get('response') or {}).get('items') or posts
+                new_posts_count = sum(post['id'] > last_post_id for post in posts if not post.get('is_pinned'))
+                self.wall_counts[vk_channel] = min(VK_WALL_COUNT_MIN + new_posts_count, VK_WALL_COUNT_MAX)
+                self.request_videos([post for post in posts if post['id'] > last_post_id])
+            owner_id = posts[0]['owner_id']
+            self.owners[owner_id] = vk_channel
+            for channel_data in channels:
+                self.state.update(channel_data, vk_channel_id=owner_id)
+            await self.pipeline.put(vk_channel, (channels, posts))
+        else:
+            self.logger.info(f'No posts in {vk_channel}')
 
-            await asyncio.sleep(60 * int(channel_data['timer']) if channel_data['timer'] else 60 * 60)
+    async def _process_source_posts(self, item: Tuple[List[Channel], List[Dict]]):
+        """pipeline stage: check fetched posts for channels which are still scheduled"""
+        channels, posts = item
+        channels = [channel_data for channel_data in channels
+                    if self.scheduled_channels.get(channel_data.id) is channel_data]
+        if channels:
+            await self.process_posts(channels, posts)
+
+    async def process_posts(self, channels: List[Channel], posts: List[Dict]):
+        """check posts of one vk source for every subscribed telegram channel"""
+        for channel_data in channels:
+            await self.set_last_post_id(channel_data, posts)
+        last_post_id = min(channel_data.last_post_id for channel_data in channels)
+        await self.prefetch_videos([post for post in posts if post['id'] > last_post_id])
+        parsed_posts = {}
+        for channel_data in channels:
+            await self.check_channel(channel_data, posts, parsed_posts)
+
+    async def push_post(self, group_id: int, post: Dict):
+        """check post received by callback api or long poll, polling finds owner id of vk source"""
+        if post.get('post_type', 'post') != 'post' or 'id' not in post:
+            return
+        owner_id = post.get('owner_id', -group_id)
+        channels = list(self.sources.get(self.owners.get(owner_id), {}).values())
+        if not channels:
+            self.logger.debug(f'Skip pushed post {owner_id}_{post["id"]} without subscribed channels')
+            return
+        self.logger.info(f'Pushed post {owner_id}_{post["id"]} from {channels[0].vk_channel}')
+        await self.pipeline.put(channels[0].vk_channel, (channels, [post]))
+
+    async def check_channel(self, channel_data: Channel, posts: List[Dict], parsed_posts: Dict[int, Post]):
+        """filter fetched posts for telegram channel and queue all new ones from oldest to newest
+
+        parsed posts are shared between channels, sender submit waits while telegram queue is full
+        """
+        started_at = time.monotonic()
+        channel_data = await self.update_post_interval(channel_data, posts)
+        new_posts_count = 0
+        for post in sorted(posts, key=lambda item: item['id']):
+            post_id = int(post.get('id'))
+            if post_id <= channel_data.last_post_id:
+                continue
+            is_allowed_post = True if not channel_data.enable_filters else await self.is_allowed_post(post)
+            if not is_allowed_post:
+                POSTS.inc('filtered')
+                continue
+            self.state.update(channel_data, last_post_id=post_id)
+            if post_id not in parsed_posts:
+                parsed_posts[post_id] = await self._parse_post(post)
+            parsed_post = parsed_posts[post_id]
+            post_url = await get_post_url(channel_data, post)
+            if channel_data.enable_filters and await self.is_duplicate_post(channel_data, parsed_post):
+                POSTS.inc('duplicate')
+                self.logger.info(f'Skip duplicate post {post_url} for {channel_data.telegram_channel}')
+                continue
+            prepared_content = await self.prepare_content(channel_data, parsed_post)
+            if not prepared_content:
+                POSTS.inc('empty')
+                continue
+            POSTS.inc('new')
+            new_posts_count += 1
+            self.logger.info(f'Found new post from {channel_data.vk_channel} -> {channel_data.telegram_channel}')
+            await self.sender.submit(channel_data.telegram_channel,
+                                     partial(self.send_content, channel_data, prepared_content, post_url,
+                                             parsed_post.date))
+            await self.content_index.add(channel_data.telegram_channel, parsed_post.fingerprints)
+        if not new_posts_count:
+            self.logger.info(f'No new posts from {channel_data.vk_channel} for {channel_data.telegram_channel}')
+        CHECK_DURATION.observe(time.monotonic() - started_at)
 
     async def prepare_content(self, channel_data, parsed_post):
         """prepare post content before send to telegram channel"""
+        started_at = time.monotonic()
         prepared_content = {}
         post_text = parsed_post.text
-        photo_text = parsed_post.text if channel_data['send_photo_post_text'] else ''
-        video_text = parsed_post.text if channel_data['send_video_post_text'] else ''
-        photo_attachments = parsed_post.attachments.get('photo')
-        video_attachments = parsed_post.attachments.get('video')
-        link_attachments = parsed_post.attachments.get('link')
-        if channel_data['send_photo_post'] and photo_attachments:
+        photo_text = parsed_post.text if channel_data.send_photo_post_text else ''
+        video_text = parsed_post.text if channel_data.send_video_post_text else ''
+        photo_attachments = parsed_post.attachments.photo
+        video_attachments = parsed_post.attachments.video
+        link_attachments = parsed_post.attachments.link
+        if channel_data.send_photo_post and photo_attachments:
             prepared_photo = [InputMediaPhoto(photo) for photo in photo_attachments]
             prepared_photo[0].caption = photo_text
             prepared_content.update({'photo': prepared_photo})
-        elif channel_data['send_video_post'] and video_attachments:
+        elif channel_data.send_video_post and video_attachments:
             prepared_video = {}
             for video_id in video_attachments:
-                video_data = await self.get_video_data(video_id)
-                parsed_video_data = video_data['response']['items'][0]['files']
+                video_data = await self.get_video(video_id)
+                parsed_video_data = video_data.get('files', {})
                 prepared_video = {quality: InputMediaVideo(video, caption=video_text)
                                   for quality, video in parsed_video_data.items()}
             prepared_content.update({'video': prepared_video})
-        elif channel_data['send_text_post'] and post_text and not (photo_text and video_text):
+        elif channel_data.send_text_post and post_text and not (photo_text and video_text):
             prepared_content.update({'text': post_text})
-        elif not channel_data['enable_filters'] and link_attachments:
-            links = [f'[{link["title"]}]({link["url"]})\n' for link in link_attachments if link["url"] not in post_text]
+        elif not channel_data.enable_filters and link_attachments:
+            links = [f'[{link.title}]({link.url})\n' for link in link_attachments if link.url not in post_text]
             prepared_content.update({'text': '\n'.join([' |'.join(links), post_text])})
+        PREPARE_DURATION.observe(time.monotonic() - started_at)
         return prepared_content
 
-    async def send_content(self, channel_data: Dict, prepared_content: Dict, post_url: str):
-        """send content to telegram"""
-        telegram_channel = await normalize_channel_name(channel_data['telegram_channel'])
-        while prepared_content.get('video') or prepared_content.get('photo') or prepared_content.get('text'):
+    async def send_content(self, channel_data: Channel, prepared_content: Dict, post_url: str, post_date: int = 0):
+        """send content to telegram, flood control errors are raised to be retried by sender
+
+        prepared content is not changed, so retry sends it again from the best video quality
+        """
+        started_at = time.monotonic()
+        is_sent = False
+        telegram_channel = await normalize_channel_name(channel_data.telegram_channel)
+        videos = list((prepared_content.get('video') or {}).values())
+        while videos or prepared_content.get('photo') or prepared_content.get('text'):
             content_to_send = []
             for content_type, content in prepared_content.items():
                 if content_type == 'video':
-                    quality, video = prepared_content.get('video').popitem()
-                    content_to_send.append(video)
+                    if videos:
+                        content_to_send.append(videos.pop())
                 elif content_type == 'photo':
                     content_to_send.extend(content)
                 elif content_type == 'text':
@@ -200,30 +531,64 @@ class VkParser(VkApi):
                         cleared_media_group = await clear_media_caption(content_to_send)
                         media_message = await self.bot.send_media_group(telegram_channel, cleared_media_group)
                         await media_message.pop().reply(text[:message_text_limit], disable_web_page_preview=True)
-                        break
                     else:
                         await self.bot.send_media_group(telegram_channel, content_to_send)
-                        break
                 else:
                     await self.bot.send_message(telegram_channel, content, parse_mode='MARKDOWN')
-                    break
+                is_sent = True
+                break
+            except RetryAfter:
+                SENT_POSTS.inc('retry')
+                raise
             except Exception as error:
                 self.logger.error(f"While sending post {post_url}: {error}")
-                text = f'***Post:*** [link]({post_url})\n***Error:*** {error} '
-                if not prepared_content.get('video'):
-                    await self.bot.send_message(ADMIN_ID, text, parse_mode='MARKDOWN', disable_web_page_preview=True)
+                if not videos:
+                    self.errors_digest.add('Telegram', type(error).__name__, str(error),
+                                           channel_data.telegram_channel)
                     break
-                await asyncio.sleep(5)
+        SEND_DURATION.observe(time.monotonic() - started_at)
+        SENT_POSTS.inc('sent' if is_sent else 'failed')
+        if is_sent and post_date:
+            lag = max(time.time() - post_date, 0)
+            DELIVERY_LAG.observe(lag)
+            CHANNEL_DELIVERY_LAG.set(lag, channel_data.telegram_channel)
+        return is_sent
+
+    async def send_admin_message(self, message: str):
+        """queue message to admin chat, it shares telegram rate limits with posts"""
+        await self.sender.submit(ADMIN_ID, partial(self.bot.send_message, ADMIN_ID, message,
+                                                   disable_web_page_preview=True))
+
+    async def load(self):
+        """load blacklist and channels from db"""
+        self.set_blacklist_words(await self.db.get_blacklist_words())
+        self.channels.load(await self.db.get_all_channels())
 
-    async def run(self):
-        """start vk parser"""
-        self.channels = self.db.get_all_channels()
-        for channel in self.channels:
-            if channel['is_active']:
-                task = self.loop.create_task(self.check_channel(channel), name=channel['id'])
-                self.channels_tasks[channel['id']] = {'channel_data': channel, 'task': task}
-                self.logger.debug(f'Started task for {channel["vk_channel"]} -> {channel["telegram_channel"]}')
+    async def run(self, schedule_channels: bool = True):
+        """start vk parser, sharded parser gets channels from shard worker"""
+        await self.open_session()
+        await self.callback_receiver.start()
+        [await client.start() for client in self.long_poll_clients]
+        now = time.time()
+        for channel in self.channels if schedule_channels else ():
+            if channel.is_active:
+                await self.schedule_channel(channel, self.get_start_delay(channel, now))
+        await self.sender.start()
+        await self.errors_digest.start()
+        await self.pipeline.start()
+        await self.state.start()
+        await self.scheduler.start()
 
     async def stop(self):
-        """stop vk parser"""
-        await self.close_all_channels_tasks()
+        """stop vk parser, queued posts are drained before channels are unscheduled"""
+        await self.callback_receiver.stop()
+        [await client.stop() for client in self.long_poll_clients]
+        await self.scheduler.stop()
+        await self.pipeline.stop(TELEGRAM_DRAIN_TIMEOUT)
+        await self.errors_digest.stop()
+        await self.sender.stop(TELEGRAM_DRAIN_TIMEOUT)
+        await self.unschedule_all_channels()
+        await self.state.stop()
+        await self.wall_batcher.cancel()
+        await self.video_batcher.cancel()
+        await self.close_session()
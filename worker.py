@@ -0,0 +1,39 @@
+import asyncio
+import logging.config
+import os
+import signal
+
+from aiogram import Bot
+
+from config import settings
+from utils.controller import Controller
+
+PATH = os.path.abspath(os.path.dirname(__file__))
+
+logging.config.fileConfig(f'{PATH}/config/logging.config')
+logger = logging.getLogger('main')
+
+
+async def run_worker():
+    """check vk sources leased from shared db until stopped by signal, every worker needs own VK_TOKENS"""
+    bot = Bot(token=settings.TELEGRAM_TOKEN)
+    controller = Controller(settings.VK_TOKENS, bot, logger, sharded=True)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(stop_signal, stop_event.set)
+
+    await controller.metrics_server.start()
+    try:
+        await controller.start_parser()
+    except RuntimeError as error:
+        logger.error(error)
+        stop_event.set()
+    await stop_event.wait()
+    await controller.shutdown()
+    await bot.close()
+
+
+if __name__ == '__main__':
+    logger.info('Start shard worker')
+    asyncio.run(run_worker())